@@ -1,10 +1,15 @@
 import math
-from io import BytesIO
-from typing import Tuple, Union
-import gc
+import time
+import struct
+import asyncio
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Set, Tuple, Union
+import cv2
 import numpy as np
 from scipy.spatial.transform import Rotation
-from scipy.ndimage import map_coordinates
+import requests
 from requests import Session
 from aiohttp import ClientSession
 from PIL import Image
@@ -12,6 +17,14 @@ from pillow_heif import register_heif_opener
 
 import GroundMetadataTile_pb2
 from auth import Authenticator
+from config import (APPLE_ROTATION_MAP_CACHE_SIZE, APPLE_COVERAGE_CACHE_SIZE, APPLE_COVERAGE_TILE_TTL,
+                    APPLE_CANVAS_POOL_BYTES)
+from buffers import BufferPool
+from metrics import metrics
+from network import fetch_tile_bytes
+from face_decoder import decode_faces
+from tile_cache import tile_cache
+from e2p import perspective_map
 from dataClass import (
     LensProjection,
     OrientedPosition,
@@ -24,6 +37,9 @@ COVERAGE_TILE_ENDPOINT = "https://gspe76-ssl.ls.apple.com/api/tile?"
 FACE_ENDPOINT = "https://gspe72-ssl.ls.apple.com/mnn_us/"
 register_heif_opener()
 
+# Face atlases of render_perspective, handed back before it returns.
+canvas_buffers = BufferPool(APPLE_CANVAS_POOL_BYTES)
+
 
 def tile_coord_to_wgs84(x: float, y: float, zoom: int) -> Tuple[float, float]:
     scale = 1 << zoom
@@ -103,18 +119,85 @@ def _create_local_ecef_basis(lat: float, lon: float) -> np.ndarray:
     return ecef_basis
 
 
-async def get_coverage_tile(tile_x: int, tile_y: int, session: ClientSession = None) \
-        -> Tuple[GroundMetadataTile_pb2.GroundMetadataTile, int]:
+async def _download_coverage_tile(tile_x: int, tile_y: int, session: ClientSession, etag: Optional[int] = None) \
+        -> Tuple[Optional[bytes], Optional[int]]:
+    """Returns the raw tile and its ETag, or (None, etag) if the server says the given ETag is still current."""
     headers = _build_coverage_tile_request_headers(tile_x, tile_y)
+    if etag is not None:
+        headers["If-None-Match"] = f'"{etag}"'
     async with session.get(COVERAGE_TILE_ENDPOINT, headers=headers) as response:
+        if response.status == 304:
+            return None, etag
         content = await response.read()
 
-    etag = response.headers["ETag"]
-    etag = int(etag[1:-1])
+    etag = response.headers.get("ETag")
+    return content, int(etag[1:-1]) if etag else None
+
+
+class CoverageTileCache:
+    """
+    Parsed z=17 coverage tiles, as ``PanoTable``, keyed by (tile_x, tile_y).
+
+    Tiles live in an in-memory LRU and, as raw protobuf, in the on-disk tile cache, so rounds in
+    the same area skip the download and the parse. A tile older than ``ttl`` seconds is
+    revalidated with its ETag and only downloaded again if it changed.
+    """
+
+    _HEADER = struct.Struct("<qd")  # ETag (-1 if none) and time of the last check, before the protobuf
+
+    def __init__(self, max_tiles: int = APPLE_COVERAGE_CACHE_SIZE, ttl: float = APPLE_COVERAGE_TILE_TTL):
+        self.max_tiles = max_tiles
+        self.ttl = ttl
+        self._tiles = OrderedDict()  # (tile_x, tile_y) -> [table, etag, content, checked_at]
+
+    def _remember(self, key, entry):
+        self._tiles[key] = entry
+        self._tiles.move_to_end(key)
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+
+    async def _load(self, tile_x: int, tile_y: int):
+        blob = await asyncio.to_thread(tile_cache.get, "apple_coverage", "", 17, tile_x, tile_y)
+        if blob is None or len(blob) < self._HEADER.size:
+            return None
+        etag, checked_at = self._HEADER.unpack_from(blob)
+        content = blob[self._HEADER.size:]
+        return [PanoTable.from_bytes(content), None if etag < 0 else etag, content, checked_at]
+
+    async def _store(self, tile_x: int, tile_y: int, entry):
+        _, etag, content, checked_at = entry
+        blob = self._HEADER.pack(-1 if etag is None else etag, checked_at) + content
+        await asyncio.to_thread(tile_cache.put, "apple_coverage", "", 17, tile_x, tile_y, blob)
+
+    async def get(self, tile_x: int, tile_y: int, session: ClientSession) -> "PanoTable":
+        key = (tile_x, tile_y)
+        entry = self._tiles.get(key)
+        if entry is None:
+            entry = await self._load(tile_x, tile_y)
+        if entry is not None:
+            self._remember(key, entry)
+            if time.time() - entry[3] < self.ttl:
+                return entry[0]
+
+        try:
+            content, etag = await _download_coverage_tile(tile_x, tile_y, session,
+                                                          entry[1] if entry is not None else None)
+        except Exception as error:
+            if entry is None:
+                raise
+            logging.error(f"Revalidating coverage tile {key} failed, using the cached one: {error}")
+            return entry[0]
+
+        if entry is not None and (content is None or (etag is not None and etag == entry[1])):
+            entry[3] = time.time()
+        else:
+            entry = [PanoTable.from_bytes(content), etag, content, time.time()]
+        self._remember(key, entry)
+        await self._store(tile_x, tile_y, entry)
+        return entry[0]
+
 
-    tile = GroundMetadataTile_pb2.GroundMetadataTile()
-    tile.ParseFromString(content)
-    return tile, etag
+coverage_tiles = CoverageTileCache()
 
 
 def _camera_metadata_to_dataclass(camera_metadata_pb: GroundMetadataTile_pb2.CameraMetadata):
@@ -143,34 +226,83 @@ def _camera_metadata_to_dataclass(camera_metadata_pb: GroundMetadataTile_pb2.Cam
     )
 
 
-def parse_coverage_tile(tile: GroundMetadataTile_pb2.GroundMetadataTile):
-    panos = []
-    camera_metadatas = [_camera_metadata_to_dataclass(c) for c in tile.camera_metadata]
-    for pano_pb in tile.pano:
-        lat, lon = protobuf_tile_offset_to_wgs84(
-            pano_pb.tile_position.x,
-            pano_pb.tile_position.y,
-            tile.tile_coordinate.x,
-            tile.tile_coordinate.y)
-        pano = LookAroundPano(
-            pano_id=pano_pb.panoid,
-            build_id=tile.build_table[pano_pb.build_table_idx].build_id,
-            lat=lat,
-            lon=lon,
+class PanoTable:
+    """
+    The panos of a coverage tile as compact arrays of id, build id and position.
+
+    Finding a round's pano only touches these arrays; the ``LookAroundPano`` with its camera
+    metadata is built for the chosen pano alone.
+    """
+    __slots__ = ("tile", "pano_ids", "build_ids", "lats", "lons")
+
+    def __init__(self, tile: GroundMetadataTile_pb2.GroundMetadataTile):
+        self.tile = tile
+        count = len(tile.pano)
+        build_ids = [build.build_id for build in tile.build_table]
+        self.pano_ids = np.fromiter((pano.panoid for pano in tile.pano), dtype=np.uint64, count=count)
+        self.build_ids = np.fromiter((build_ids[pano.build_table_idx] for pano in tile.pano),
+                                     dtype=np.uint64, count=count)
+
+        # protobuf_tile_offset_to_wgs84 for every pano at once
+        scale = 1 << 17
+        x_offset = np.fromiter((pano.tile_position.x for pano in tile.pano), dtype=np.float64, count=count)
+        y_offset = np.fromiter((pano.tile_position.y for pano in tile.pano), dtype=np.float64, count=count)
+        pano_x = tile.tile_coordinate.x + (x_offset / 64.0) / 255
+        pano_y = tile.tile_coordinate.y + (255 - (y_offset / 64.0)) / 255
+        self.lons = pano_x / scale * 360.0 - 180.0
+        self.lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pano_y / scale))))
+
+    @classmethod
+    def from_bytes(cls, content: bytes) -> "PanoTable":
+        tile = GroundMetadataTile_pb2.GroundMetadataTile()
+        tile.ParseFromString(content)
+        return cls(tile)
+
+    def __len__(self):
+        return len(self.pano_ids)
+
+    def find(self, pano_id: int) -> Optional[int]:
+        """Index of the pano with this id, if it is on the tile."""
+        matches = np.flatnonzero(self.pano_ids == np.uint64(pano_id))
+        return int(matches[0]) if len(matches) else None
+
+    def nearest(self, lat: float, lon: float) -> Optional[int]:
+        """Index of the pano closest to (lat, lon), or None if the tile is empty."""
+        if not len(self):
+            return None
+        # An equirectangular approximation is exact enough within one z=17 tile
+        dx = (self.lons - lon) * math.cos(math.radians(lat))
+        dy = self.lats - lat
+        return int(np.argmin(dx * dx + dy * dy))
+
+    def materialize(self, index: int) -> LookAroundPano:
+        """Builds the full ``LookAroundPano`` for the pano at ``index``."""
+        pano_pb = self.tile.pano[index]
+        tile = self.tile
+        return LookAroundPano(
+            pano_id=int(self.pano_ids[index]),
+            build_id=int(self.build_ids[index]),
+            lat=float(self.lats[index]),
+            lon=float(self.lons[index]),
             raw_orientation=(pano_pb.tile_position.yaw, pano_pb.tile_position.pitch, pano_pb.tile_position.roll),
             tile=(tile.tile_coordinate.x, tile.tile_coordinate.y, tile.tile_coordinate.z),
-            camera_metadata=[camera_metadatas[i] for i in pano_pb.camera_metadata_idx]
+            camera_metadata=[_camera_metadata_to_dataclass(tile.camera_metadata[i])
+                             for i in pano_pb.camera_metadata_idx]
         )
-        panos.append(pano)
-    return panos
 
 
-async def get_apple_coverage_tile(lat: float, lon: float, session: ClientSession = None):
+async def get_apple_coverage_tile(lat: float, lon: float, session: ClientSession = None, pano_id: int = None):
+    """
+    Returns the pano closest to (lat, lon) on its z=17 coverage tile, or the pano with
+    ``pano_id`` if it is given and on that tile.
+    """
     tile_x, tile_y = wgs84_to_tile_coord(lat, lon, 17)
-    tile, etag = await get_coverage_tile(tile_x, tile_y, session)
-    panos = parse_coverage_tile(tile)
-    if panos and len(panos) > 0:
-        return panos[0]
+    table = await coverage_tiles.get(tile_x, tile_y, session)
+    index = table.find(pano_id) if pano_id is not None else None
+    if index is None:
+        index = table.nearest(lat, lon)
+    if index is not None:
+        return table.materialize(index)
 
 
 def _panoid_to_string(pano: Union[LookAroundPano, Tuple[int, int]]) -> Tuple[str, str]:
@@ -200,25 +332,221 @@ def get_panorama_face(pano: Union[LookAroundPano, Tuple[int, int]],
         return response.content
 
 
-def get_apple_equ(pano: LookAroundPano, zoom: int, auth: Authenticator, session: Session = None):
-    faces = []
-    for face in Face:
-        face_heic = get_panorama_face(pano, face, zoom, auth, session)
-        image = Image.open(BytesIO(face_heic))
-        faces.append(image)
-    stitched_image = to_equirectangular_np(faces, pano.camera_metadata)
-    return np.array(stitched_image)
+async def fetch_panorama_face(pano: Union[LookAroundPano, Tuple[int, int]],
+                              face: Union[Face, int], zoom: int,
+                              auth: Authenticator, session: ClientSession) -> bytes:
+    """Downloads one HEIC face over the shared aiohttp session, with retries and hedging."""
+    panoid, build_id = _panoid_to_string(pano)
+    cached = await asyncio.to_thread(tile_cache.get, "apple", f"{panoid}/{build_id}", zoom, int(face), 0)
+    if cached is not None:
+        return cached
 
+    url = _build_panorama_face_url(panoid, build_id, int(face), zoom, auth)
+    start = time.perf_counter()
+    data = await fetch_tile_bytes(session, url, provider="apple")
+    elapsed = time.perf_counter() - start
+    metrics.observe("apple_face_time", elapsed)
+    logging.debug(f"Apple face {Face(int(face)).name} of {panoid} took {elapsed * 1000:.0f} ms")
+    if data is None:
+        raise Exception(f"Error getting apple pano face {int(face)} of {panoid}")
+    tile_cache.put_later([("apple", f"{panoid}/{build_id}", zoom, int(face), 0, data)])
+    return data
+
+
+async def fetch_panorama_faces(pano: LookAroundPano, zoom: int, auth: Authenticator, session: ClientSession,
+                               faces: Set[int] = None):
+    """
+    Downloads the given faces, all six by default, concurrently. Returns a list in Face order
+    with None for the faces that were not requested.
+    """
+    wanted = [face for face in Face if faces is None or face in faces]
+    # Sign every face in one batch; fetch_panorama_face then finds its URL in the signed-URL cache
+    panoid, build_id = _panoid_to_string(pano)
+    auth.authenticate_urls([_panorama_face_url(panoid, build_id, int(face), zoom) for face in wanted])
+    downloaded = await asyncio.gather(*[fetch_panorama_face(pano, face, zoom, auth, session) for face in wanted])
+    faces_heic = [None] * len(Face)
+    for face, face_heic in zip(wanted, downloaded):
+        faces_heic[face] = face_heic
+    return faces_heic
+
+
+def face_coverage(camera_metadata_list, height: int = 128) -> np.ndarray:
+    """
+    Low resolution masks, shape (6, height, 2 * height), of where each face lands on the
+    equirectangular panorama: side faces by their yaw and field of view, top and bottom faces
+    centred and then rotated into place.
+    """
+    width = 2 * height
+    masks = np.zeros((len(camera_metadata_list), height, width), dtype=bool)
+    for face_index, camera_metadata in enumerate(camera_metadata_list):
+        face_width, face_height = face_size(camera_metadata, height)
+        if face_index > 3:
+            patch = np.zeros((height, width), dtype=np.uint8)
+            x, y = (width - face_width) // 2, (height - face_height) // 2
+            patch[max(y, 0):y + face_height, max(x, 0):x + face_width] = 255
+            # Uncached: these small maps must not push the full-size ones out of the cache
+            map_x, map_y = _rotation_maps.__wrapped__(-camera_metadata.position.yaw, camera_metadata.position.pitch,
+                                                      camera_metadata.position.roll, width, height)
+            masks[face_index] = cv2.remap(patch, map_x, map_y, cv2.INTER_NEAREST,
+                                          borderMode=cv2.BORDER_WRAP) > 0
+        else:
+            phi_start = math.pi + camera_metadata.position.yaw - (camera_metadata.lens_projection.fov_s / 2)
+            theta_start = ((math.pi / 2) - (camera_metadata.lens_projection.fov_h / 2)
+                           - camera_metadata.lens_projection.cy)
+            x = int(phi_start * (height / math.pi))
+            y = int(theta_start * (height / math.pi))
+            rows = np.arange(max(y, 0), min(y + face_height, height))
+            cols = np.arange(x, x + face_width) % width
+            masks[face_index][np.ix_(rows, cols)] = True
+    return masks
+
+
+def _wrapped_morphology(operation, mask: np.ndarray, radius: int = 1) -> np.ndarray:
+    """
+    Applies a square cv2.dilate / cv2.erode that wraps around both edges, like the
+    ``cv2.BORDER_WRAP`` sampling of ``Equirectangular.GetPerspective`` does near the poles.
+    """
+    padded = np.pad(mask, radius, mode="wrap")
+    kernel = np.ones((2 * radius + 1, 2 * radius + 1), np.uint8)
+    return operation(padded, kernel)[radius:-radius, radius:-radius]
+
+
+def visible_faces(camera_metadata_list, FOV, THETA, PHI, height, width) -> Set[int]:
+    """
+    The faces that contribute pixels to a perspective view of the panorama.
+
+    Where faces overlap, the lower index wins (face 0 ends up on top), so a face only counts
+    where no face above it covers the view. The check runs on a
+    coarse grid, dilated so that faces touching the view's edge are kept. At least
+    one side face is always included, since the panorama width is derived from it.
+    """
+    masks = face_coverage(camera_metadata_list)
+    grid_height, grid_width = masks.shape[1:]
+    X, Y = perspective_map(FOV, THETA, PHI, height, width, (grid_height, grid_width))
+    view = np.zeros((grid_height, grid_width), dtype=np.uint8)
+    view[np.clip(Y.astype(np.int32), 0, grid_height - 1), np.clip(X.astype(np.int32), 0, grid_width - 1)] = 1
+    view = _wrapped_morphology(cv2.dilate, view, radius=2).astype(bool)
+
+    faces = set()
+    covered = np.zeros((grid_height, grid_width), dtype=np.uint8)
+    for face_index in range(len(masks)):
+        # Erode what the faces above cover, so a face showing along their edges is kept
+        hidden = _wrapped_morphology(cv2.erode, covered).astype(bool)
+        if (view & masks[face_index] & ~hidden).any():
+            faces.add(face_index)
+        covered[masks[face_index]] = 1
+    if not faces & {0, 1, 2, 3}:
+        faces.add(0)
+    return faces
+
+
+async def get_apple_faces(pano: LookAroundPano, zoom: int, auth: Authenticator, session: ClientSession,
+                          faces: Set[int] = None) -> List[Optional[np.ndarray]]:
+    """
+    Downloads and decodes the given faces (all six by default) at their own resolution, as RGB
+    arrays in Face order with None for the faces that were not requested.
+    """
+    faces_heic = await fetch_panorama_faces(pano, zoom, auth, session, faces)
+    present = [i for i, face_heic in enumerate(faces_heic) if face_heic is not None]
+    decoded = await asyncio.to_thread(decode_faces, [faces_heic[i] for i in present], None, "RGB")
+    face_images = [None] * len(faces_heic)
+    for i, face in zip(present, decoded):
+        face_images[i] = face
+    return face_images
+
+
+_ATLAS_PADDING = 2  # border around each face in the atlas, so bicubic samples never bleed into a neighbour
+
+
+def render_perspective(faces: List[Optional[np.ndarray]], camera_metadata_list,
+                       FOV, THETA, PHI, height, width) -> np.ndarray:
+    """
+    Renders a perspective view straight from the face images in a single ``cv2.remap``.
+
+    The view is the one ``Equirectangular.GetPerspective`` would take from the stitched
+    panorama, without building the equirectangular canvas: every output pixel is traced back
+    through the panorama to the face shown there (face 0 on top, then 1, 2, ...; see
+    ``face_coverage``), using each face's lens field of view and orientation. The
+    faces are packed into one padded atlas and sampled once, at their native resolution.
+
+    :param faces: RGB face arrays in Face order; None for faces that are not needed.
+    :return: The RGB view, black where no given face covers it.
+    """
+    side_face = next(face for face in faces[:4] if face is not None)
+    full_width = equirectangular_width(side_face.shape[1])
+    full_height = full_width // 2
+    X, Y = perspective_map(FOV, THETA, PHI, height, width, (full_height, full_width))
+
+    # Stack the faces vertically, each inside a replicated border
+    pad = _ATLAS_PADDING
+    offsets, atlas_height = {}, 0
+    for face_index, face in enumerate(faces):
+        if face is not None:
+            offsets[face_index] = atlas_height + pad
+            atlas_height += face.shape[0] + 2 * pad
+    atlas_width = max(faces[i].shape[1] for i in offsets) + 2 * pad
+    # Not zeroed: every sample lands inside a face or its replicated border
+    atlas = canvas_buffers.acquire((atlas_height, atlas_width, 3), zero=False)
+    for face_index, top in offsets.items():
+        face = faces[face_index]
+        atlas[top - pad:top + face.shape[0] + pad, :face.shape[1] + 2 * pad] = cv2.copyMakeBorder(
+            face, pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+
+    map_x = np.full((height, width), -1, dtype=np.float32)
+    map_y = np.full((height, width), -1, dtype=np.float32)
+    unassigned = np.ones((height, width), dtype=bool)
+    for face_index, top in offsets.items():
+        camera_metadata = camera_metadata_list[face_index]
+        face_height, face_width = faces[face_index].shape[:2]
+        scaled_width, scaled_height = face_size(camera_metadata, full_height)
 
-def _build_panorama_face_url(panoid: str, build_id: str, face: int, zoom: int, auth: Authenticator) -> str:
+        if face_index > 3:
+            # Rotate back into the canvas the face is centred on before it is rotated into place
+            theta = X * np.float32(2 * math.pi / full_width) - np.float32(math.pi)
+            phi = Y * np.float32(math.pi / full_height) - np.float32(math.pi / 2)
+            R = get_rotation_matrix(-camera_metadata.position.yaw, camera_metadata.position.pitch,
+                                    camera_metadata.position.roll)
+            vx, vy, vz = np.cos(phi) * np.sin(theta), np.sin(phi), np.cos(phi) * np.cos(theta)
+            canvas_x = (np.arctan2(R[0, 0] * vx + R[0, 1] * vy + R[0, 2] * vz,
+                                   R[2, 0] * vx + R[2, 1] * vy + R[2, 2] * vz) + np.float32(math.pi)) \
+                * np.float32(full_width / (2 * math.pi))
+            canvas_y = (np.arcsin(np.clip(R[1, 0] * vx + R[1, 1] * vy + R[1, 2] * vz, -1, 1))
+                        + np.float32(math.pi / 2)) * np.float32(full_height / math.pi)
+            dx = canvas_x - int((full_width - scaled_width) / 2)
+            dy = canvas_y - int((full_height - scaled_height) / 2)
+        else:
+            # Side faces sit at their yaw, wrapping around the seam
+            phi_start = math.pi + camera_metadata.position.yaw - (camera_metadata.lens_projection.fov_s / 2)
+            if phi_start < 0:
+                phi_start += 2 * math.pi
+            theta_start = ((math.pi / 2) - (camera_metadata.lens_projection.fov_h / 2)
+                           - camera_metadata.lens_projection.cy)
+            dx = np.mod(X - int(phi_start * (full_height / math.pi)), full_width)
+            dy = Y - int(theta_start * (full_height / math.pi))
+
+        inside = unassigned & (dx >= 0) & (dx < scaled_width) & (dy >= 0) & (dy < scaled_height)
+        # Pixel centres of the scaled face back to the native face
+        map_x[inside] = (dx[inside] + 0.5) * (face_width / scaled_width) - 0.5 + pad
+        map_y[inside] = (dy[inside] + 0.5) * (face_height / scaled_height) - 0.5 + top
+        unassigned &= ~inside
+
+    try:
+        return cv2.remap(atlas, map_x, map_y, cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    finally:
+        canvas_buffers.release(atlas)
+
+
+def _panorama_face_url(panoid: str, build_id: str, face: int, zoom: int) -> str:
     zoom = min(7, zoom)
     panoid_padded = panoid.zfill(20)
     panoid_split = [panoid_padded[i:i + 4] for i in range(0, len(panoid_padded), 4)]
     panoid_url = "/".join(panoid_split)
     build_id_padded = build_id.zfill(10)
-    url = FACE_ENDPOINT + f"{panoid_url}/{build_id_padded}/t/{face}/{zoom}"
-    url = auth.authenticate_url(url)
-    return url
+    return FACE_ENDPOINT + f"{panoid_url}/{build_id_padded}/t/{face}/{zoom}"
+
+
+def _build_panorama_face_url(panoid: str, build_id: str, face: int, zoom: int, auth: Authenticator) -> str:
+    return auth.authenticate_url(_panorama_face_url(panoid, build_id, face, zoom))
 
 
 def get_rotation_matrix(yaw, pitch, roll):
@@ -239,122 +567,57 @@ def get_rotation_matrix(yaw, pitch, roll):
     return Ry @ Rx @ Rz
 
 
-def equirectangular_rotate(img: Image.Image, yaw, pitch, roll):
-    img_np = np.asarray(img).astype(np.float64)
-    H, W = img_np.shape[:2]
-
-    x, y = np.meshgrid(np.arange(W, dtype=np.float64), np.arange(H, dtype=np.float64))
-    theta = (x / W) * 2 * math.pi - math.pi
-    phi = (y / H) * math.pi - (math.pi / 2)
-
-    vx = np.cos(phi) * np.sin(theta)
-    vy = np.sin(phi)
-    vz = np.cos(phi) * np.cos(theta)
-    vectors = np.stack([vx, vy, vz], axis=-1).reshape(-1, 3)
+@lru_cache(maxsize=APPLE_ROTATION_MAP_CACHE_SIZE)
+def _rotation_maps(yaw, pitch, roll, W, H):
+    """Read-only float32 cv2.remap maps of ``equirectangular_rotate``, cached per rotation and size."""
+    theta = np.arange(W, dtype=np.float32) * np.float32(2 * math.pi / W) - np.float32(math.pi)
+    phi = np.arange(H, dtype=np.float32) * np.float32(math.pi / H) - np.float32(math.pi / 2)
+    sin_theta, cos_theta = np.sin(theta)[None, :], np.cos(theta)[None, :]
+    sin_phi, cos_phi = np.sin(phi)[:, None], np.cos(phi)[:, None]
 
+    # Rotated unit vector of every output pixel, one component at a time to keep peak memory low
     R = get_rotation_matrix(yaw, pitch, roll)
-    vectors_rot = vectors @ R.T
-    vx_r, vy_r, vz_r = vectors_rot[:, 0], vectors_rot[:, 1], vectors_rot[:, 2]
-
-    theta_r = np.arctan2(vx_r, vz_r)
-    phi_r = np.arcsin(np.clip(vy_r, -1, 1))
-
-    map_x = ((theta_r + math.pi) / (2 * math.pi)) * W
-    map_y = ((phi_r + math.pi / 2) / math.pi) * H
-
-    map_x = np.clip(map_x, 0, W - 1)
-    map_y = np.clip(map_y, 0, H - 1)
-
-    map_x = map_x.astype(np.float64)
-    map_y = map_y.astype(np.float64)
-
-    output = np.zeros((H, W, img_np.shape[2]), dtype=np.uint8)
-
-    for c in range(img_np.shape[2]):
-        channel = img_np[..., c].astype(np.float64, copy=False)
-
-        sampled = map_coordinates(
-            channel,
-            [map_y.flatten(), map_x.flatten()],
-            order=1,
-            mode='wrap'
-        )
-        output[..., c] = sampled.reshape(H, W).astype(np.uint8)
-
-    del img_np, vectors, vectors_rot, vx_r, vy_r, vz_r, map_x, map_y
-    gc.collect()
-
-    return Image.fromarray(output, mode=img.mode)
-
-
-def project_top_or_bottom_face_np(face: Image.Image, camera_metadata, full_width: int, full_height: int):
-    phi_length = camera_metadata.lens_projection.fov_s
-    theta_length = camera_metadata.lens_projection.fov_h
-
-    face_width = int(phi_length * (full_height / math.pi))
-    face_height = int(theta_length * (full_height / math.pi))
-
-    x = int((full_width - face_width) / 2)
-    y = int((full_height - face_height) / 2)
-
-    input_img = Image.new("RGBA", (full_width, full_height), (0, 0, 0, 0))
-    scaled_face = face.resize((face_width, face_height), Image.LANCZOS)
-    input_img.paste(scaled_face, (x, y))
-    del face, scaled_face
-
-    yaw = -camera_metadata.position.yaw
-    pitch = camera_metadata.position.pitch
-    roll = camera_metadata.position.roll
-
-    reprojected_img = equirectangular_rotate(input_img, yaw, pitch, roll)
-    del input_img
-    gc.collect()
-
-    return reprojected_img
-
-
-def paste_side_face_np(face: Image.Image, camera_metadata, full_width: int, full_height: int, stitched: Image.Image):
-    phi_start = math.pi + camera_metadata.position.yaw - (camera_metadata.lens_projection.fov_s / 2)
-    if phi_start < 0:
-        phi_start += 2 * math.pi
-
-    theta_start = (math.pi / 2) - (camera_metadata.lens_projection.fov_h / 2) - camera_metadata.lens_projection.cy
-    phi_length = camera_metadata.lens_projection.fov_s
-    theta_length = camera_metadata.lens_projection.fov_h
-
-    face_width = int(phi_length * (full_height / math.pi))
-    face_height = int(theta_length * (full_height / math.pi))
-
-    x = int(phi_start * (full_height / math.pi))
-    y = int(theta_start * (full_height / math.pi))
-
-    scaled_face = face.resize((math.ceil(face_width), math.ceil(face_height)), Image.LANCZOS)
-    if scaled_face.mode != "RGBA":
-        scaled_face = scaled_face.convert("RGBA")
-    mask = scaled_face.split()[-1]
-
-    stitched.paste(scaled_face, (math.ceil(x), math.ceil(y)), mask)
-    if x + scaled_face.width > full_width:
-        stitched.paste(scaled_face, (math.ceil(x - full_width), math.ceil(y)), mask)
-
-    del face, scaled_face, mask
-    gc.collect()
-
+    vx_r = R[0, 0] * cos_phi * sin_theta + R[0, 1] * sin_phi + R[0, 2] * cos_phi * cos_theta
+    vz_r = R[2, 0] * cos_phi * sin_theta + R[2, 1] * sin_phi + R[2, 2] * cos_phi * cos_theta
+    map_x = np.arctan2(vx_r, vz_r)
+    del vx_r, vz_r
+    map_x += np.float32(math.pi)
+    map_x *= np.float32(W / (2 * math.pi))
+    np.clip(map_x, 0, W - 1, out=map_x)
+
+    vy_r = R[1, 0] * cos_phi * sin_theta + R[1, 1] * sin_phi + R[1, 2] * cos_phi * cos_theta
+    np.clip(vy_r, -1, 1, out=vy_r)
+    map_y = np.arcsin(vy_r)
+    del vy_r
+    map_y += np.float32(math.pi / 2)
+    map_y *= np.float32(H / math.pi)
+    np.clip(map_y, 0, H - 1, out=map_y)
+
+    map_x.setflags(write=False)
+    map_y.setflags(write=False)
+    return map_x, map_y
+
+
+def equirectangular_rotate(img: Union[Image.Image, np.ndarray], yaw, pitch, roll, dst: np.ndarray = None):
+    """
+    Rotates an equirectangular image. Arrays are rotated into ``dst`` when it is given (it must
+    match the input's shape and dtype) and returned as arrays; PIL images come back as images.
+    """
+    img_np = np.asarray(img)
+    H, W = img_np.shape[:2]
+    map_x, map_y = _rotation_maps(yaw, pitch, roll, W, H)
+    output = cv2.remap(img_np, map_x, map_y, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_WRAP)
+    if isinstance(img, Image.Image):
+        return Image.fromarray(output, mode=img.mode)
+    return output
 
-def to_equirectangular_np(faces, camera_metadata_list):
-    full_width = round(faces[0].width * (1024 / 5632)) * 16
-    full_height = full_width // 2
 
-    stitched = Image.new("RGBA", (full_width, full_height), (0, 0, 0, 0))
+def equirectangular_width(back_face_width: int) -> int:
+    """Width of the stitched panorama for faces whose first (back) face is this wide."""
+    return round(back_face_width * (1024 / 5632)) * 16
 
-    for face_index in range(5, -1, -1):
-        if face_index > 3:
-            projected = project_top_or_bottom_face_np(faces[face_index], camera_metadata_list[face_index], full_width,
-                                                      full_height)
-            stitched.alpha_composite(projected)
-            del projected
-        else:
-            paste_side_face_np(faces[face_index], camera_metadata_list[face_index], full_width, full_height, stitched)
 
-    gc.collect()
-    return stitched.convert("RGB")
+def face_size(camera_metadata, full_height: int) -> Tuple[int, int]:
+    """Size a face is scaled to before it is placed on a panorama of the given height."""
+    return (int(camera_metadata.lens_projection.fov_s * (full_height / math.pi)),
+            int(camera_metadata.lens_projection.fov_h * (full_height / math.pi)))
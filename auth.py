@@ -4,8 +4,13 @@ import hashlib
 import random
 import string
 import time
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
 from urllib.parse import urlparse, quote
 
+from config import AUTH_KEY_POOL_SIZE, AUTH_URL_CACHE_SIZE, AUTH_URL_REUSE_WINDOW
+
 
 # based on https://github.com/retroplasma/flyover-reverse-engineering
 # MIT(?)
@@ -16,12 +21,27 @@ class Authenticator:
     Various requests to internal Apple Maps endpoints, such as Look Around imagery, must be
     dynamically authenticated with a session ID and access key.
     This class provides this functionality.
+
+    The AES keys are derived once for a small pool of random ``token_p3`` values, and signed
+    URLs are reused for as long as their access key stays valid for most of its lifetime, so
+    signing a face that was signed recently costs a dictionary lookup.
     """
     TOKEN_P1 = "4cjLaD4jGRwlQ9U"
     TOKEN_P2 = "72xIzEBe0vHBmf9"
 
-    def __init__(self):
+    def __init__(self, key_pool_size: int = AUTH_KEY_POOL_SIZE, url_cache_size: int = AUTH_URL_CACHE_SIZE,
+                 reuse_window: int = AUTH_URL_REUSE_WINDOW):
         self.session_id = _generate_session_id()
+        self.reuse_window = reuse_window
+        self.url_cache_size = url_cache_size
+        self._keys = [self._derive_key(_generate_token_p3()) for _ in range(key_pool_size)]
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _derive_key(cls, token_p3: str) -> Tuple[str, bytes]:
+        token = cls.TOKEN_P1 + cls.TOKEN_P2 + token_p3
+        return token_p3, hashlib.sha256(token.encode()).digest()
 
     def authenticate_url(self, url: str) -> str:
         """
@@ -30,11 +50,39 @@ class Authenticator:
         :param url: An unauthenticated URL.
         :return: An authenticated URL.
         """
+        return self.authenticate_urls([url])[0]
+
+    def authenticate_urls(self, urls: List[str]) -> List[str]:
+        """
+        Appends authentication parameters to several URLs at once.
+
+        All of them share one expiry. URLs signed earlier in the same reuse window come from the
+        cache; an access key is valid for 4200 s, and a cached one has at least
+        ``4200 - reuse_window`` s left.
+
+        :param urls: Unauthenticated URLs.
+        :return: The authenticated URLs, in the same order.
+        """
+        window = int(time.time()) // self.reuse_window
+        timestamp = window * self.reuse_window + 4200
+        signed = []
+        with self._lock:
+            for url in urls:
+                cached = self._urls.get((url, window))
+                if cached is None:
+                    cached = self._sign(url, timestamp)
+                    self._urls[(url, window)] = cached
+                    if len(self._urls) > self.url_cache_size:
+                        self._urls.popitem(last=False)
+                else:
+                    self._urls.move_to_end((url, window))
+                signed.append(cached)
+        return signed
+
+    def _sign(self, url: str, timestamp: int) -> str:
         url_obj = urlparse(url)
 
-        token_p3 = _generate_token_p3()
-        token = self.TOKEN_P1 + self.TOKEN_P2 + token_p3
-        timestamp = int(time.time()) + 4200
+        token_p3, key = random.choice(self._keys)
         separator = "&" if url_obj.query else "?"
 
         url_path = url_obj.path
@@ -42,7 +90,6 @@ class Authenticator:
             url_path += "?" + url_obj.query
         plaintext = f"{url_path}{separator}sid={self.session_id}{timestamp}{token_p3}"
         plaintext_bytes = _pad_pkcs7(plaintext.encode("utf-8"))
-        key = hashlib.sha256(token.encode()).digest()
         iv = b"\0" * 16
         cipher = AES.new(key, AES.MODE_CBC, iv)
         ciphertext = cipher.encrypt(plaintext_bytes)
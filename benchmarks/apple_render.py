@@ -0,0 +1,87 @@
+"""
+Latency and peak memory of rendering Apple views with and without the atlas pool.
+
+Renders ``rounds`` views of the same synthetic faces with ``apple.render_perspective``, once
+with ``canvas_buffers`` enabled and once with it disabled. Each mode runs in its own
+interpreter so the reported peak RSS (``ru_maxrss``) belongs to that mode alone.
+
+Run from the repository root: ``python -m benchmarks.apple_render [rounds] [face width]``
+"""
+import sys
+import math
+import time
+import resource
+import subprocess
+
+import cv2
+import numpy as np
+
+import apple
+from dataClass import LensProjection, OrientedPosition, CameraMetadata
+
+
+def make_metadata():
+    """Four side faces around the horizon and a top and bottom face, roughly like a real pano."""
+    metadata = []
+    for i in range(4):
+        metadata.append(CameraMetadata(
+            LensProjection(fov_s=math.radians(100), fov_h=math.radians(110), k2=0, k3=0, k4=0,
+                           cx=0, cy=0.1, lx=0, ly=0),
+            OrientedPosition(0, 0, 0, yaw=i * math.pi / 2 - math.pi, pitch=0, roll=0)))
+    for sign in (1, -1):
+        metadata.append(CameraMetadata(
+            LensProjection(fov_s=math.radians(60), fov_h=math.radians(60), k2=0, k3=0, k4=0,
+                           cx=0, cy=0, lx=0, ly=0),
+            OrientedPosition(0, 0, 0, yaw=0.3, pitch=sign * math.pi / 2, roll=0)))
+    return metadata
+
+
+def make_faces(width, metadata):
+    """RGB faces at their native resolution, as the face decoder returns them."""
+    rng = np.random.default_rng(0)
+    full_height = apple.equirectangular_width(width) // 2
+    faces = []
+    for camera_metadata in metadata:
+        face_width, face_height = apple.face_size(camera_metadata, full_height)
+        noise = rng.integers(0, 256, (max(face_height // 16, 1), max(face_width // 16, 1), 3), dtype=np.uint8)
+        faces.append(cv2.resize(noise, (face_width, face_height), interpolation=cv2.INTER_CUBIC))
+    # The panorama width is derived from the first face's own width
+    faces[0] = cv2.resize(faces[0], (width, faces[0].shape[0]))
+    return faces
+
+
+def run(rounds, width, pooled):
+    if not pooled:
+        apple.canvas_buffers.max_bytes = 0
+    metadata = make_metadata()
+    faces = make_faces(width, metadata)
+
+    render_times = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        apple.render_perspective(faces, metadata, 90, (i * 37) % 360 - 180, 0, 1080, 1920)
+        render_times.append(time.perf_counter() - start)
+
+    # Linux reports ru_maxrss in KiB
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    # The first round builds the perspective map, so it is left out
+    render_times = np.array(render_times[1:]) * 1000
+    print(f"{'pooled' if pooled else 'unpooled':8}  "
+          f"render p50 {np.percentile(render_times, 50):6.1f} ms  p95 {np.percentile(render_times, 95):6.1f} ms  "
+          f"peak RSS {peak_rss:7.1f} MB")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ("--pooled", "--unpooled"):
+        run(int(sys.argv[2]), int(sys.argv[3]), sys.argv[1] == "--pooled")
+        return
+
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1408
+    print(f"{rounds} rounds, {apple.equirectangular_width(width)} px wide panorama")
+    for mode in ("--unpooled", "--pooled"):
+        subprocess.run([sys.executable, "-m", "benchmarks.apple_render", mode, str(rounds), str(width)], check=True)
+
+
+if __name__ == "__main__":
+    main()
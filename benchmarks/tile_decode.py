@@ -0,0 +1,84 @@
+"""
+Measures how long tile decoding blocks the event loop.
+
+Stitches a zoom 4 Gen 4 panorama (128 JPEG tiles of 512x512) twice: the old way, opening and
+pasting the tiles with PIL on the loop thread, and through ``tiles.stitch_as_completed`` on the
+decode pool, with downloads that are already done. A ticker task records how late the loop
+wakes it up, which is what Discord heartbeats and guess handling would see.
+
+Run from the repository root: ``python -m benchmarks.tile_decode``
+"""
+import io
+import time
+import asyncio
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from config import TILE_DECODE_WORKERS
+from tiles import stitch_as_completed
+
+COLS, ROWS, TILE_SIZE = 16, 8, 512
+TICK = 0.005
+
+
+def make_tiles():
+    rng = np.random.default_rng(0)
+    tiles = {}
+    for y in range(ROWS):
+        for x in range(COLS):
+            noise = rng.integers(0, 256, (TILE_SIZE // 8, TILE_SIZE // 8, 3), dtype=np.uint8)
+            tile = cv2.resize(noise, (TILE_SIZE, TILE_SIZE), interpolation=cv2.INTER_CUBIC)
+            tiles[(x, y)] = cv2.imencode(".jpg", tile, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    return tiles
+
+
+async def measure(stitch):
+    """Runs stitch() next to a ticker and returns (wall time, longest and total loop stall)."""
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            stalls.append(max(0.0, time.perf_counter() - start - TICK))
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    start = time.perf_counter()
+    await stitch()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker_task
+    return elapsed, max(stalls, default=0.0), sum(stalls)
+
+
+async def main():
+    tiles = make_tiles()
+
+    async def on_loop():
+        canvas = Image.new("RGB", (COLS * TILE_SIZE, ROWS * TILE_SIZE))
+        for (x, y), data in tiles.items():
+            canvas.paste(Image.open(io.BytesIO(data)), (x * TILE_SIZE, y * TILE_SIZE))
+        return np.array(canvas)
+
+    async def downloaded(data):
+        return data
+
+    async def on_pool():
+        canvas = np.zeros((ROWS * TILE_SIZE, COLS * TILE_SIZE, 3), dtype=np.uint8)
+        await stitch_as_completed([(canvas, x * TILE_SIZE, y * TILE_SIZE, downloaded(data))
+                                   for (x, y), data in tiles.items()])
+        return canvas
+
+    print(f"{len(tiles)} tiles, {TILE_DECODE_WORKERS} decode workers")
+    for name, stitch in (("PIL on loop", on_loop), ("decode pool", on_pool)):
+        elapsed, worst, total = await measure(stitch)
+        print(f"{name:12s} wall {elapsed * 1000:7.1f} ms  "
+              f"longest stall {worst * 1000:7.1f} ms  total stall {total * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
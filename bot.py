@@ -3,13 +3,20 @@ from discord.ext import commands
 from discord.ext.commands import BucketType, CommandOnCooldown
 from regions import REGIONS, RegionFlatmap
 from asyncio import Queue, create_task, gather
+from collections import deque
 import os
 import io
 import asyncio
 import random
 from typing import Optional, List
-from models import GameManager, Pano, Round
+from models import GameManager, Pano, Round, get_provider
+from prefetch import RoundPrefetcher
 from geoguessr import GeoGuessr
+from network import HttpPool
+from metrics import metrics
+from hosts import host_health
+from tile_cache import tile_cache
+import face_decoder
 import logging
 import numpy as np
 import sqlite3
@@ -37,10 +44,11 @@ class PanoProcessor:
     async def add_pano(self, pano: Pano, heading: float, pitch: float) -> None:
         await self.queue.put((pano, heading, pitch))
 
-    async def process_pano(self, pano: Pano, heading: float, pitch: float) -> Optional[np.ndarray]:
+    async def process_pano(self, pano: Pano, heading: float, pitch: float,
+                           preview: bool = False) -> Optional[np.ndarray]:
 
         try:
-            numpy_result = await pano.get_panorama(heading, pitch)
+            numpy_result = await pano.get_panorama(heading, pitch, preview=preview)
             if numpy_result is None:
                 return None
             pano.img = Pano.add_compass(numpy_result,
@@ -82,13 +90,18 @@ class GeoGuessrBot(commands.Bot):
                          proxy="http://127.0.0.1:7890")
 
         # Managers
+        self.http_pool = HttpPool()
         self.geoguessr_games = {}  # channel_id -> GeoGuessr
         self.game_manager = GameManager(RegionFlatmap(REGIONS[DEFAULT_MAP['map_code']]))
         self.pano_processor = PanoProcessor(max_concurrent=3)
+        self.prefetchers = {}  # channel_id -> RoundPrefetcher filling game_manager.next_rounds
+        self.image_upgrades = {}  # channel_id -> task replacing a preview round image with the full render
         self.add_commands()
         self.streak_mode = "state"
 
     async def setup_hook(self):
+        await self.http_pool.start()
+        host_health.start(self.http_pool.session)
         await self.pano_processor.start()
 
     async def on_ready(self):
@@ -108,6 +121,12 @@ class GeoGuessrBot(commands.Bot):
     async def close(self):
         logging.info("Bot is shutting down, saving all game states...")
 
+        # Nothing may advance a game or keep downloading once its state is saved
+        for prefetcher in self.prefetchers.values():
+            prefetcher.stop()
+        for channel_id in list(self.image_upgrades):
+            self.cancel_image_upgrade(channel_id)
+
         for channel_id in self.geoguessr_games.keys():
             try:
                 game = self.geoguessr_games[channel_id]
@@ -115,6 +134,13 @@ class GeoGuessrBot(commands.Bot):
             except Exception as e:
                 logging.error(f"Failed to save state for channel {channel_id}: {e}")
 
+        await self.pano_processor.stop()
+        await host_health.stop()
+        face_decoder.shutdown()
+        await asyncio.to_thread(tile_cache.close)
+        await super().close()
+        await self.http_pool.close()
+
     async def on_error(self, event_method: str, *args, **kwargs):
         """Called when an event raises an uncaught exception"""
         logging.error(f"Error in {event_method}: {args}, {kwargs}")
@@ -167,9 +193,12 @@ class GeoGuessrBot(commands.Bot):
             await self.start_new_game(channel)
             return
 
-        # Reconstruct game state
+        # Reconstruct game state. A prefetcher left from before a reconnect would keep advancing
+        # the game and filling a queue that is no longer the channel's.
+        self.cancel_image_upgrade(channel.id)
+        self.reset_prefetcher(channel)
         game_data = json.loads(game_data)
-        self.geoguessr_games[channel.id] = GeoGuessr()
+        self.geoguessr_games[channel.id] = GeoGuessr(self.http_pool.session)
         self.geoguessr_games[channel.id].game = game_data
 
         if game_data.get("map") in WORLD_MAPS:
@@ -182,11 +211,14 @@ class GeoGuessrBot(commands.Bot):
                     self.game_manager.reset_subdivisions(RegionFlatmap(REGIONS[names[-1]]))
         # Restore round objects
         current = json.loads(current_round)
-        next_r = json.loads(next_round)
+        upcoming = GameManager.saved_rounds(next_round)
 
         # Reconstruct Round objects and fetch their images
-        self.game_manager.rounds[channel.id] = await Round.reconstruct_round(current, self.pano_processor)
-        self.game_manager.next_rounds[channel.id] = await Round.reconstruct_round(next_r, self.pano_processor)
+        self.game_manager.rounds[channel.id] = await Round.reconstruct_round(current, self.pano_processor,
+                                                                          self.http_pool.session)
+        self.game_manager.next_rounds[channel.id].extend(await gather(*[
+            Round.reconstruct_round(round_data, self.pano_processor, self.http_pool.session) for round_data in upcoming
+        ]))
 
         # Restore game manager state
         self.game_manager.streak[channel.id] = streak
@@ -201,17 +233,21 @@ class GeoGuessrBot(commands.Bot):
 
         await self.process_commands(message)
 
-    async def process_round(self, game_data: dict, round_index: int, channel=None) -> Round:
-        """Process a specific round from the game data"""
+    async def process_round(self, game_data: dict, round_index: int, channel=None, preview: bool = False) -> Round:
+        """Process a specific round from the game data. With ``preview`` the image is a quick low zoom render."""
         round_data = game_data['rounds'][round_index]
-        round = Round(round_data)
+        round = Round(round_data, self.http_pool.session)
 
         if game_data['map'] == 'baidu':
-            await self.pano_processor.process_pano(round.pano, round.heading, round.pitch)
+            # The location comes from the pano's metadata alone, so geocoding runs while the tiles download
+            await round.pano.get_pano_metadata_bd()
             round_data['lat'] = round.pano.lat
             round_data['lng'] = round.pano.lng
 
-            await round.set_subdivision(round_data, self.streak_mode)
+            await gather(
+                self.pano_processor.process_pano(round.pano, round.heading, round.pitch, preview),
+                round.set_subdivision(round_data, self.streak_mode)
+            )
 
             logging.info(f"Finished set_subdivision for round {round_index}.")
 
@@ -224,7 +260,7 @@ class GeoGuessrBot(commands.Bot):
             if game_data['map'] in map_to_pano_id and not round.pano.pano_id:
                 round.pano.pano_id = map_to_pano_id[game_data['map']]
             tasks = await gather(
-                self.pano_processor.process_pano(round.pano, round.heading, round.pitch),
+                self.pano_processor.process_pano(round.pano, round.heading, round.pitch, preview),
                 round.set_subdivision(round_data, self.streak_mode)
             )
             if any(task is None for task in tasks):
@@ -236,6 +272,7 @@ class GeoGuessrBot(commands.Bot):
     async def start_new_game(self, channel, map_id=None):
         """Start a new game in the specified channel"""
         logging.info(f"{channel.id}: Starting new game")
+        started = time.perf_counter()
         self.game_manager.reset_5k_attempts(channel.id)
 
         if not map_id:
@@ -258,7 +295,7 @@ class GeoGuessrBot(commands.Bot):
 
         # Initialize with default map if needed
         if channel.id not in self.geoguessr_games:
-            self.geoguessr_games[channel.id] = GeoGuessr()
+            self.geoguessr_games[channel.id] = GeoGuessr(self.http_pool.session)
             if not map_id:
                 self.streak_mode = 'state'
                 self.game_manager.reset_subdivisions(RegionFlatmap(REGIONS[DEFAULT_MAP['map_code']]))
@@ -272,6 +309,8 @@ class GeoGuessrBot(commands.Bot):
                         self.game_manager.reset_subdivisions(RegionFlatmap(REGIONS[names[-1]]))
             self.game_manager.streak[channel.id] = 0
 
+        # The old game's queued rounds are dropped before its refill can advance the new game
+        prefetcher = self.reset_prefetcher(channel)
         game = await self.geoguessr_games[channel.id].create_geoguessr_game(map_id)
 
         # Store the map name for display
@@ -286,62 +325,80 @@ class GeoGuessrBot(commands.Bot):
         game = await self.geoguessr_games[channel.id].guess_and_advance()
         current_idx = game.get('round') - 2
 
-        logging.info(f"{channel.id}: Processing rounds {current_idx} and {current_idx + 1}")
-        tasks = [
-            self.process_round(game, current_idx, channel),  # Current round
-            self.process_round(game, current_idx + 1, channel)  # Next round
-        ]
+        logging.info(f"{channel.id}: Processing round {current_idx}, prefetching from {current_idx + 1}")
 
-        results = await gather(*tasks)
-        if not any(results):
+        # The current round is shown as soon as its preview is ready, while the queue fills behind it
+        self.cancel_image_upgrade(channel.id)
+        prefetcher.refill(revealed=(game, current_idx + 1))
+        current_round = await self.process_round(game, current_idx, channel, preview=True)
+        if current_round is None:
             logging.error(f"{channel.id}: Error processing rounds")
             await channel.send("Error processing rounds. Use !fix.")
             return
 
-        self.game_manager.rounds[channel.id] = results[0]
-        self.game_manager.next_rounds[channel.id] = results[1]
+        self.game_manager.set_round(channel.id, current_round)
 
-        await self.show_round(channel)
+        await self.show_round(channel, started)
         self.game_manager.waiting_for_guess[channel.id] = True
 
     async def start_new_round(self, channel):
         logging.info(f"{channel.id}: Starting new round")
+        started = time.perf_counter()
         self.game_manager.reset_5k_attempts(channel.id)
 
         if channel.id not in self.geoguessr_games:
             await self.start_new_game(channel)
             return
 
-        geoguessr = self.geoguessr_games[channel.id]
-        if channel.id in self.game_manager.next_rounds:
-            logging.info(f"{channel.id}: Got prefetch for round {geoguessr.game.get('round')}")
-            self.game_manager.rounds[channel.id] = self.game_manager.next_rounds[channel.id]
-            del self.game_manager.next_rounds[channel.id]
-
-            # Start the show_round immediately
-            show_task = create_task(self.show_round(channel))
+        # The previous round may still be loading its full image, which nobody will see now
+        self.cancel_image_upgrade(channel.id)
 
-            # Start processing next round in background
-            game = await geoguessr.guess_and_advance()
-            if not game:
-                logging.debug("WARNING: Game not found after advancing.")
+        prefetcher = self.get_prefetcher(channel)
+        next_round = await prefetcher.pop()
+        if next_round is None:
+            # A !fix or map switch that replaced the prefetcher meanwhile has started its own game
+            if self.prefetchers.get(channel.id) is prefetcher:
                 await self.start_new_game(channel)
-                return
-
-            current_idx = game.get('round') - 1
-            if current_idx < len(game['rounds']):
-                async def process_next():
-                    next_round = await self.process_round(game, current_idx, channel)
-                    if next_round:
-                        self.game_manager.next_rounds[channel.id] = next_round
-
-                create_task(process_next())
-
-            await show_task
-        else:
-            await self.start_new_game(channel)
+            return
 
-    async def show_round(self, channel):
+        logging.info(f"{channel.id}: Got prefetched round {next_round.pano.pano_id}")
+        self.game_manager.set_round(channel.id, next_round)
+        await self.show_round(channel, started)
+
+    def get_prefetcher(self, channel) -> RoundPrefetcher:
+        """The channel's round prefetcher, created around its (possibly restored) next_rounds queue."""
+        prefetcher = self.prefetchers.get(channel.id)
+        if prefetcher is None:
+            async def advance():
+                game = await self.geoguessr_games[channel.id].guess_and_advance()
+                if not game:
+                    logging.debug("WARNING: Game not found after advancing.")
+                    return None
+                if game.get('round') - 1 >= len(game['rounds']):
+                    return None
+                return game, game.get('round') - 1
+
+            async def process(game, round_index):
+                return await self.process_round(game, round_index, channel)
+
+            rounds = self.game_manager.next_rounds.setdefault(channel.id, deque())
+            prefetcher = self.prefetchers[channel.id] = RoundPrefetcher(channel.id, rounds, advance, process)
+        return prefetcher
+
+    def reset_prefetcher(self, channel) -> RoundPrefetcher:
+        """Drops the rounds prefetched for the channel's old game, e.g. when it switches maps."""
+        prefetcher = self.prefetchers.pop(channel.id, None)
+        if prefetcher is not None:
+            prefetcher.cancel()
+        self.game_manager.next_rounds[channel.id] = deque()
+        return self.get_prefetcher(channel)
+
+    async def show_round(self, channel, started: float = None):
+        """
+        Posts the current round's image. If it is a preview (see ``Pano.get_panorama``) the
+        full render follows as an edit of the same message. ``started`` is when the round was
+        requested, for the time-to-first-image metric.
+        """
         logging.info(f"{channel.id}: Showing round")
 
         try:
@@ -368,15 +425,49 @@ class GeoGuessrBot(commands.Bot):
                 # Send messages
                 await channel.send(embed=embed)
 
-                await channel.send(file=discord.File(img_byte_arr, 'round.jpg'))
+                message = await channel.send(file=discord.File(img_byte_arr, 'round.jpg'))
                 self.game_manager.waiting_for_guess[channel.id] = True
 
+                provider = get_provider(round_obj.pano.pano_id)
+                if started is not None:
+                    metrics.observe(f"time_to_first_image.{provider}", time.perf_counter() - started)
+                pending = self.image_upgrades.get(channel.id)
+                if round_obj.pano.preview and (pending is None or pending.done()):
+                    self.image_upgrades[channel.id] = create_task(
+                        self.upgrade_round_image(channel, round_obj, message, started))
+
             create_task(send_image())
 
         except Exception as e:
             logging.error(f"{channel.id}: Error showing round: {e}")
             await channel.send("Unable to show image at this time.")
 
+    async def upgrade_round_image(self, channel, round_obj: Round, message: discord.Message, started: float = None):
+        """Renders the round at full zoom and swaps it into the message that shows its preview."""
+        try:
+            img = await self.pano_processor.process_pano(round_obj.pano, round_obj.heading, round_obj.pitch)
+            if img is None or self.game_manager.rounds.get(channel.id) is not round_obj:
+                return
+
+            img_byte_arr = io.BytesIO()
+            img.save(img_byte_arr, format='JPEG', quality=100)
+            img_byte_arr.seek(0)
+            await message.edit(attachments=[discord.File(img_byte_arr, 'round.jpg')])
+            if started is not None:
+                metrics.observe(f"time_to_full_image.{get_provider(round_obj.pano.pano_id)}",
+                                time.perf_counter() - started)
+        except Exception as e:
+            logging.error(f"{channel.id}: Error replacing preview image: {e}")
+
+    def cancel_image_upgrade(self, channel_id):
+        """
+        Drops a pending full render once its round is over. The pano's buffers go back to the
+        pool only after the decodes it already started have finished (see ``Pano.release``).
+        """
+        upgrade = self.image_upgrades.pop(channel_id, None)
+        if upgrade is not None:
+            upgrade.cancel()
+
     async def notify_top_streak(self, ctx, streak_number: int):
         """
         Check if the ended streak is in any top 5 and notify the channel.
@@ -1196,6 +1287,18 @@ class GeoGuessrBot(commands.Bot):
             # TODO: remains to be seen if this is best
             await self.start_new_game(ctx.channel)
 
+        @self.command(name='metrics')
+        @commands.has_any_role(*MOD_ROLE_NAMES)
+        async def show_metrics(ctx):
+            """Show image pipeline counters and latencies (tile hedge rate per provider)"""
+            lines = metrics.summary()
+            for name, requests in metrics.counters("tile_requests.").items():
+                provider = name.split(".", 1)[1]
+                hedges = metrics.count(f"tile_hedges.{provider}")
+                lines.append(f"{provider} hedge rate: {hedges / requests:.1%}")
+            text = "\n".join(lines) or "No metrics recorded yet."
+            await ctx.send(f"```\n{text[-1900:]}\n```")
+
         @self.command(name='leaderboard', aliases=['lb', 'top', 'record', 'records'])
         @commands.cooldown(1, 1, BucketType.user)
         async def leaderboard(ctx, *args):
@@ -0,0 +1,51 @@
+import threading
+from collections import defaultdict
+from typing import Tuple
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    Recycles large image arrays between rounds.
+
+    Panoramas of the same provider and zoom have the same shape, so a released buffer can back
+    the next panorama instead of allocating (and page-faulting) a fresh ~100 MB array. Buffers
+    beyond ``max_bytes`` of idle memory are simply dropped.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.idle_bytes = 0
+        self._free = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8, zero: bool = True) -> np.ndarray:
+        """Returns an array of the given shape, reused if one is idle. Zero-filled unless ``zero`` is False."""
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            buffer = free.pop() if free else None
+            if buffer is not None:
+                self.idle_bytes -= buffer.nbytes
+
+        if buffer is None:
+            return np.zeros(shape, dtype=dtype) if zero else np.empty(shape, dtype=dtype)
+        if zero:
+            buffer.fill(0)
+        return buffer
+
+    def release(self, buffer: np.ndarray):
+        """Hands a buffer back. The caller must not touch it afterwards."""
+        if buffer is None or buffer.base is not None:
+            return
+        with self._lock:
+            if self.idle_bytes + buffer.nbytes > self.max_bytes:
+                return
+            self._free[(buffer.shape, buffer.dtype)].append(buffer)
+            self.idle_bytes += buffer.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self.idle_bytes = 0
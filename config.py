@@ -58,3 +58,71 @@ REGIONS_NAMES = {
 DEFAULT_MAP = {"map_id": "61dfb63654e4730001e8faf5", "map_code": "us"}
 
 MOD_ROLE_NAMES = ["Mod", "Moderator"]
+
+# Shared HTTP connection pool
+HTTP_CONNECTION_LIMIT = 100
+HTTP_CONNECTION_LIMIT_PER_HOST = 32
+HTTP_KEEPALIVE_TIMEOUT = 60  # seconds an idle connection is kept open
+HTTP_DNS_CACHE_TTL = 300  # seconds
+
+# Tile requests: retries back off exponentially with jitter, and a request slower than the
+# provider's recent TILE_HEDGE_PERCENTILE latency is duplicated (the first response wins)
+TILE_REQUEST_TIMEOUT = 10  # seconds
+TILE_RETRIES = 3
+TILE_BACKOFF_BASE = 0.25  # seconds
+TILE_BACKOFF_MAX = 4  # seconds
+TILE_HEDGE_PERCENTILE = 95
+TILE_HEDGE_MIN_SAMPLES = 20  # responses timed before hedging starts
+TILE_HEDGE_MIN_DELAY = 0.05  # seconds
+
+# Interchangeable tile hosts per provider; requests are spread over the healthy ones
+TILE_MIRRORS = {
+    "google": [f"https://geo{i}.ggpht.com/cbk" for i in range(4)],
+    "baidu": [f"https://mapsv{i}.bdimg.com/?qt=pdata" for i in range(2)],
+    "tencent": [f"https://sv{i}.map.qq.com/tile" for i in range(4)],
+    "openmap": ["https://storage.nambox.com/streetview-cdn/derivates/",
+                "https://hn.storage.weodata.vn/streetview-cdn/derivates/"],
+}
+HOST_PROBE_INTERVAL = 60  # seconds between health probes of every mirror
+HOST_PROBE_TIMEOUT = 5  # seconds
+HOST_EWMA_ALPHA = 0.2  # weight of the newest sample in the latency / error rate averages
+HOST_MAX_ERROR_RATE = 0.5  # mirrors failing more often than this are skipped
+
+# On-disk tile cache
+TILE_CACHE_DIR = "tile_cache"
+TILE_CACHE_MAX_BYTES = 2 * 1024 ** 3  # evict least recently used tiles beyond 2 GB
+TILE_CACHE_TOUCH_BATCH = 256  # cache hits whose access time is written in one transaction
+
+# Threads decoding panorama tiles off the event loop
+TILE_DECODE_WORKERS = 8
+
+# Idle panorama buffers kept for reuse by the next round (0 disables reuse)
+PANORAMA_BUFFER_POOL_BYTES = 512 * 1024 ** 2
+
+# Progressive round images: a quick render this many zoom levels down is posted first, then
+# replaced by the full render (0 disables the preview)
+ROUND_PREVIEW_ZOOM_STEPS = 2
+
+# Upcoming rounds processed ahead of time per channel, and the memory their panoramas may hold;
+# rounds beyond the budget keep only their rendered image
+ROUND_PREFETCH_DEPTH = 3
+ROUND_PREFETCH_MAX_BYTES = 512 * 1024 ** 2
+
+# Perspective projection remap grids. A 1080x1920 view's pair of float32 maps is ~16.6 MB.
+# Maps of heading 0 are kept per (FOV, pitch, output size, panorama size); a view at another
+# heading is a cheap shift of them, so per-heading maps only need to outlive the viewport
+# planner and the render of the same view. At most ~210 MB of maps stay cached.
+PERSPECTIVE_BASE_MAP_CACHE_SIZE = 4
+PERSPECTIVE_MAP_CACHE_SIZE = 2  # per heading, in e2p and for cube atlases
+CUBE_EQUIRECT_MAP_CACHE_SIZE = 1  # cube to equirectangular maps, ~64 MB at 2048x4096
+PERSPECTIVE_FIXED_POINT_MAPS = False  # 16-bit maps: half the memory and faster, ~1/32 px precision
+
+# Apple Look Around
+APPLE_ROTATION_MAP_CACHE_SIZE = 4  # top/bottom face rotation maps kept per (yaw, pitch, roll, size), ~64 MB each
+APPLE_DECODE_WORKERS = 6  # processes decoding and resizing the six HEIC faces of a pano
+APPLE_COVERAGE_CACHE_SIZE = 256  # parsed z=17 coverage tiles kept in memory
+APPLE_COVERAGE_TILE_TTL = 6 * 3600  # seconds before a cached coverage tile is revalidated by ETag
+APPLE_CANVAS_POOL_BYTES = 256 * 1024 ** 2  # idle face atlases kept for reuse (0 disables reuse)
+AUTH_KEY_POOL_SIZE = 16  # (token_p3, AES key) pairs derived once per authenticator
+AUTH_URL_CACHE_SIZE = 1024  # signed Look Around URLs kept for reuse
+AUTH_URL_REUSE_WINDOW = 600  # seconds a signed URL is reused; access keys are valid for 4200 s
@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 x_pi = 3.14159265358979324 * 3000.0 / 180.0
 pi = 3.1415926535897932384626  # π
 a = 6378245.0  # 长半轴
@@ -194,4 +196,129 @@ def bd09mc_to_wgs84(x, y):
     return bd09_to_wgs84(bd09[0], bd09[1])
 
 def out_of_china(lng, lat):
-    return not (lng > 73.66 and lng < 135.05 and lat > 3.86 and lat < 53.55)
\ No newline at end of file
+    return not (lng > 73.66 and lng < 135.05 and lat > 3.86 and lat < 53.55)
+
+
+# Vectorised counterparts of the functions above. They take array-likes of coordinates (any
+# matching shapes, scalars included) and return a (lng, lat) / (x, y) tuple of float64 arrays,
+# so whole columns of the rounds table or batches of guesses convert in one call.
+
+_LL2MC_NP = np.array(LL2MC)
+_MC2LL_NP = np.array(MC2LL)
+_MCBAND_NP = np.array(MCBAND)
+_LLBAND_NP = np.array(LLBAND)
+
+
+def out_of_china_np(lng, lat):
+    lng, lat = np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    return ~((lng > 73.66) & (lng < 135.05) & (lat > 3.86) & (lat < 53.55))
+
+
+def _transformlat_np(lng, lat):
+    ret = -100.0 + 2.0 * lng + 3.0 * lat + 0.2 * lat * lat + \
+          0.1 * lng * lat + 0.2 * np.sqrt(np.fabs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * pi) + 20.0 *
+            np.sin(2.0 * lng * pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lat * pi) + 40.0 *
+            np.sin(lat / 3.0 * pi)) * 2.0 / 3.0
+    ret += (160.0 * np.sin(lat / 12.0 * pi) + 320 *
+            np.sin(lat * pi / 30.0)) * 2.0 / 3.0
+    return ret
+
+
+def _transformlng_np(lng, lat):
+    ret = 300.0 + lng + 2.0 * lat + 0.1 * lng * lng + \
+          0.1 * lng * lat + 0.1 * np.sqrt(np.fabs(lng))
+    ret += (20.0 * np.sin(6.0 * lng * pi) + 20.0 *
+            np.sin(2.0 * lng * pi)) * 2.0 / 3.0
+    ret += (20.0 * np.sin(lng * pi) + 40.0 *
+            np.sin(lng / 3.0 * pi)) * 2.0 / 3.0
+    ret += (150.0 * np.sin(lng / 12.0 * pi) + 300.0 *
+            np.sin(lng / 30.0 * pi)) * 2.0 / 3.0
+    return ret
+
+
+def _gcj02_offset_np(lng, lat):
+    """The GCJ-02 minus WGS-84 offset at (lng, lat), zero outside China."""
+    dlat = _transformlat_np(lng - 105.0, lat - 35.0)
+    dlng = _transformlng_np(lng - 105.0, lat - 35.0)
+    radlat = lat / 180.0 * pi
+    magic = np.sin(radlat)
+    magic = 1 - ee * magic * magic
+    sqrtmagic = np.sqrt(magic)
+    dlat = (dlat * 180.0) / ((a * (1 - ee)) / (magic * sqrtmagic) * pi)
+    dlng = (dlng * 180.0) / (a / sqrtmagic * np.cos(radlat) * pi)
+    outside = out_of_china_np(lng, lat)
+    return np.where(outside, 0.0, dlng), np.where(outside, 0.0, dlat)
+
+
+def gcj02_to_bd09_np(lng, lat):
+    lng, lat = np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    z = np.sqrt(lng * lng + lat * lat) + 0.00002 * np.sin(lat * x_pi)
+    theta = np.arctan2(lat, lng) + 0.000003 * np.cos(lng * x_pi)
+    return z * np.cos(theta) + 0.0065, z * np.sin(theta) + 0.006
+
+
+def bd09_to_gcj02_np(bd_lon, bd_lat):
+    x = np.asarray(bd_lon, dtype=np.float64) - 0.0065
+    y = np.asarray(bd_lat, dtype=np.float64) - 0.006
+    z = np.sqrt(x * x + y * y) - 0.00002 * np.sin(y * x_pi)
+    theta = np.arctan2(y, x) - 0.000003 * np.cos(x * x_pi)
+    return z * np.cos(theta), z * np.sin(theta)
+
+
+def wgs84_to_gcj02_np(lng, lat):
+    lng, lat = np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    dlng, dlat = _gcj02_offset_np(lng, lat)
+    return lng + dlng, lat + dlat
+
+
+def gcj02_to_wgs84_np(lng, lat):
+    lng, lat = np.asarray(lng, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    dlng, dlat = _gcj02_offset_np(lng, lat)
+    return lng - dlng, lat - dlat
+
+
+def bd09_to_wgs84_np(bd_lon, bd_lat):
+    return gcj02_to_wgs84_np(*bd09_to_gcj02_np(bd_lon, bd_lat))
+
+
+def wgs84_to_bd09_np(lon, lat):
+    return gcj02_to_bd09_np(*wgs84_to_gcj02_np(lon, lat))
+
+
+def _convertor_np(x, y, coefficients):
+    """``convertor`` with one coefficient row per point, shape (..., 10)."""
+    c = np.moveaxis(coefficients, -1, 0)
+    T = c[0] + c[1] * np.abs(x)
+    cB = np.abs(y) / c[9]
+    cE = (c[2] + c[3] * cB + c[4] * cB ** 2 +
+          c[5] * cB ** 3 + c[6] * cB ** 4 +
+          c[7] * cB ** 5 + c[8] * cB ** 6)
+    return np.where(x < 0, -T, T), np.where(y < 0, -cE, cE)
+
+
+def convert_ll2mc_np(lat, lng):
+    lat, lng = np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64)
+    # get_loop and get_range
+    x = np.where(lng > 180, lng - 360 * np.ceil((lng - 180) / 360), lng)
+    x = np.where(x < -180, x + 360 * np.ceil((-180 - x) / 360), x)
+    y = np.clip(lat, -74, 74)
+    # First band at or below y; like convert_ll2mc, southern latitudes all use the last band
+    band = np.argmax(y[..., None] >= _LLBAND_NP, axis=-1)
+    band = np.where(y < 0, len(LLBAND) - 1, band)
+    return _convertor_np(x, y, _LL2MC_NP[band])
+
+
+def convert_mc2ll_np(x, y):
+    x, y = np.abs(np.asarray(x, dtype=np.float64)), np.abs(np.asarray(y, dtype=np.float64))
+    band = np.argmax(y[..., None] >= _MCBAND_NP, axis=-1)
+    return _convertor_np(x, y, _MC2LL_NP[band])
+
+
+def bd09mc_to_gcj02_np(x, y):
+    return bd09_to_gcj02_np(*convert_mc2ll_np(x, y))
+
+
+def bd09mc_to_wgs84_np(x, y):
+    return bd09_to_wgs84_np(*convert_mc2ll_np(x, y))
@@ -0,0 +1,113 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from config import PERSPECTIVE_MAP_CACHE_SIZE, CUBE_EQUIRECT_MAP_CACHE_SIZE
+from e2p import view_rays, _read_only
+
+# Faces in py360convert order (front, right, back, left, up, down). For each face: the axis it
+# faces, then the directions of its +x (right) and +y (down) pixel axes, in view_rays' frame.
+_FACE_AXES = np.array([
+    [[0, 0, 1], [1, 0, 0], [0, 1, 0]],
+    [[1, 0, 0], [0, 0, -1], [0, 1, 0]],
+    [[0, 0, -1], [-1, 0, 0], [0, 1, 0]],
+    [[-1, 0, 0], [0, 0, 1], [0, 1, 0]],
+    [[0, -1, 0], [1, 0, 0], [0, 0, 1]],
+    [[0, 1, 0], [1, 0, 0], [0, 0, -1]],
+], dtype=np.float64)
+
+ATLAS_PADDING = 2  # replicated border around each face, so bicubic samples never cross into the next face
+
+
+def atlas_shape(face_w: int, channels: int = 3) -> Tuple[int, int, int]:
+    """Shape of an atlas holding six square faces of ``face_w`` stacked vertically."""
+    side = face_w + 2 * ATLAS_PADDING
+    return 6 * side, side, channels
+
+
+def atlas_faces(atlas: np.ndarray) -> List[np.ndarray]:
+    """Writable views of the six faces inside an atlas, in py360convert order."""
+    side = atlas.shape[1]
+    p = ATLAS_PADDING
+    return [atlas[k * side + p:(k + 1) * side - p, p:side - p] for k in range(6)]
+
+
+def pad_atlas(atlas: np.ndarray):
+    """Fills each face's border from its edge pixels, once the faces are in place."""
+    side = atlas.shape[1]
+    p = ATLAS_PADDING
+    for k in range(6):
+        block = atlas[k * side:(k + 1) * side]
+        block[:p, p:-p] = block[p:p + 1, p:-p]
+        block[-p:, p:-p] = block[-p - 1:-p, p:-p]
+        block[:, :p] = block[:, p:p + 1]
+        block[:, -p:] = block[:, -p - 1:-p]
+
+
+def _sample_map(rays, face_w):
+    """Atlas coordinates of the cube face pixel each ray hits, as float32 (X, Y)."""
+    facing = rays @ _FACE_AXES[:, 0].T
+    face = np.argmax(facing, axis=-1)[..., None]
+    depth = np.take_along_axis(facing, face, -1)[..., 0]
+    right = np.take_along_axis(rays @ _FACE_AXES[:, 1].T, face, -1)[..., 0]
+    down = np.take_along_axis(rays @ _FACE_AXES[:, 2].T, face, -1)[..., 0]
+
+    # Faces span [-1, 1] on the plane at depth 1; pixel centres sit half a pixel in from the edge
+    half = face_w / 2
+    X = np.clip(half * (1 + right / depth) - 0.5, -0.5, face_w - 0.5) + ATLAS_PADDING
+    Y = np.clip(half * (1 + down / depth) - 0.5, -0.5, face_w - 0.5) + ATLAS_PADDING
+    Y += face[..., 0] * (face_w + 2 * ATLAS_PADDING)
+    return X.astype(np.float32), Y.astype(np.float32)
+
+
+@lru_cache(maxsize=PERSPECTIVE_MAP_CACHE_SIZE)
+def cube_perspective_map(FOV, THETA, PHI, height, width, face_w):
+    """
+    Read-only float32 ``cv2.remap`` maps sampling a perspective view straight from a cube face
+    atlas. Angles are in degrees, as for ``e2p.perspective_map``.
+    """
+    return _read_only(*_sample_map(view_rays(FOV, THETA, PHI, height, width), face_w))
+
+
+@lru_cache(maxsize=CUBE_EQUIRECT_MAP_CACHE_SIZE)
+def cube_equirect_map(face_w, height, width, chunk_rows=256):
+    """
+    Read-only float32 ``cv2.remap`` maps sampling an equirectangular image of the given size
+    from a cube face atlas, on py360convert's longitude/latitude grid. Built a band of rows at
+    a time so the float64 temporaries stay small.
+    """
+    lon = np.linspace(-np.pi, np.pi, num=width)
+    lat = np.linspace(np.pi / 2, -np.pi / 2, num=height)
+    X = np.empty((height, width), dtype=np.float32)
+    Y = np.empty((height, width), dtype=np.float32)
+    for top in range(0, height, chunk_rows):
+        band = lat[top:top + chunk_rows, None]
+        rays = np.stack(np.broadcast_arrays(np.cos(band) * np.sin(lon), -np.sin(band),
+                                            np.cos(band) * np.cos(lon)), axis=-1)
+        X[top:top + chunk_rows], Y[top:top + chunk_rows] = _sample_map(rays, face_w)
+    return _read_only(X, Y)
+
+
+class Cubemap:
+    """
+    Six cube faces packed into one atlas (see ``atlas_faces``), in py360convert's face
+    orientation. Views and equirectangular conversions are each sampled from the faces in a
+    single remap, with maps cached per face and output size.
+    """
+
+    def __init__(self, atlas: np.ndarray):
+        self._atlas = atlas
+        self.face_w = atlas.shape[1] - 2 * ATLAS_PADDING
+
+    def GetPerspective(self, FOV, THETA, PHI, height, width):
+        #
+        # THETA is left/right angle, PHI is up/down angle, both in degree
+        #
+        map_x, map_y = cube_perspective_map(FOV, THETA, PHI, height, width, self.face_w)
+        return cv2.remap(self._atlas, map_x, map_y, cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+    def ToEquirectangular(self, height, width):
+        map_x, map_y = cube_equirect_map(self.face_w, height, width)
+        return cv2.remap(self._atlas, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
@@ -4,7 +4,7 @@ from dataclasses import dataclass
 from datetime import datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class LensProjection:
     fov_s: float
     """Phi size of the panorama face."""
@@ -21,7 +21,7 @@ class LensProjection:
     ly: float  #:
 
 
-@dataclass
+@dataclass(slots=True)
 class OrientedPosition:
     """Position and rotation of a panorama face in the scene. Angles are in radians."""
     x: float  #:
@@ -32,13 +32,13 @@ class OrientedPosition:
     roll: float  #:
 
 
-@dataclass
+@dataclass(slots=True)
 class CameraMetadata:
     lens_projection: LensProjection
     position: OrientedPosition
 
 
-@dataclass
+@dataclass(slots=True)
 class LookAroundPano:
     pano_id: int
 
@@ -1,6 +1,10 @@
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
+from config import PERSPECTIVE_BASE_MAP_CACHE_SIZE, PERSPECTIVE_MAP_CACHE_SIZE, PERSPECTIVE_FIXED_POINT_MAPS
+
 def xyz2lonlat(xyz):
     atan2 = np.arctan2
     asin = np.arcsin
@@ -26,6 +30,77 @@ def lonlat2XY(lonlat, shape):
 
     return out 
 
+def view_rays(FOV, THETA, PHI, height, width):
+    """Direction (x right, y down, z forward) of every pixel of a perspective view, shape (height, width, 3)."""
+    f = 0.5 * width * 1 / np.tan(0.5 * FOV / 180.0 * np.pi)
+    cx = (width - 1) / 2.0
+    cy = (height - 1) / 2.0
+    K = np.array([
+            [f, 0, cx],
+            [0, f, cy],
+            [0, 0,  1],
+        ], np.float32)
+    K_inv = np.linalg.inv(K)
+
+    x = np.arange(width)
+    y = np.arange(height)
+    x, y = np.meshgrid(x, y)
+    z = np.ones_like(x)
+    xyz = np.concatenate([x[..., None], y[..., None], z[..., None]], axis=-1)
+    xyz = xyz @ K_inv.T
+
+    y_axis = np.array([0.0, 1.0, 0.0], np.float32)
+    x_axis = np.array([1.0, 0.0, 0.0], np.float32)
+    R1, _ = cv2.Rodrigues(y_axis * np.radians(THETA))
+    R2, _ = cv2.Rodrigues(np.dot(R1, x_axis) * np.radians(PHI))
+    R = R2 @ R1
+    return xyz @ R.T
+
+def _compute_map(FOV, THETA, PHI, height, width, shape):
+    lonlat = xyz2lonlat(view_rays(FOV, THETA, PHI, height, width))
+    return lonlat2XY(lonlat, shape=shape).astype(np.float32)
+
+def _read_only(*arrays):
+    for array in arrays:
+        array.setflags(write=False)
+    return arrays
+
+@lru_cache(maxsize=PERSPECTIVE_BASE_MAP_CACHE_SIZE)
+def _base_map(FOV, PHI, height, width, shape):
+    # The view looking at THETA = 0; other headings are a horizontal shift of it
+    XY = _compute_map(FOV, 0, PHI, height, width, shape)
+    return _read_only(np.ascontiguousarray(XY[..., 0]), np.ascontiguousarray(XY[..., 1]))
+
+@lru_cache(maxsize=PERSPECTIVE_MAP_CACHE_SIZE)
+def perspective_map(FOV, THETA, PHI, height, width, shape):
+    """
+    Source pixel coordinates sampled by a perspective view of an equirectangular image.
+
+    Returns two read-only float32 arrays of shape (height, width), the X and Y of the source
+    pixel for every output pixel. THETA is left/right angle, PHI is up/down angle, both in
+    degree. Results are cached; turning the camera left or right only shifts the cached X map
+    of the same FOV and PHI, so a new heading skips the trigonometry.
+    """
+    X, Y = _base_map(FOV, PHI, height, width, shape[:2])
+    if THETA % 360 == 0:
+        return X, Y
+    # The yaw rotation adds THETA to every longitude, i.e. shifts X around the seam
+    period = shape[1] - 1
+    X = X + np.float32(THETA / 360.0 * period)
+    np.mod(X, period, out=X)
+    return _read_only(X, Y)
+
+@lru_cache(maxsize=PERSPECTIVE_MAP_CACHE_SIZE)
+def remap_maps(FOV, THETA, PHI, height, width, shape):
+    """
+    The ``cv2.remap`` maps for ``perspective_map``, as 16-bit fixed-point maps from
+    ``cv2.convertMaps`` if PERSPECTIVE_FIXED_POINT_MAPS is set.
+    """
+    X, Y = perspective_map(FOV, THETA, PHI, height, width, shape)
+    if not PERSPECTIVE_FIXED_POINT_MAPS or max(shape[:2]) >= 2 ** 15:
+        return X, Y
+    return _read_only(*cv2.convertMaps(X, Y, cv2.CV_16SC2))
+
 class Equirectangular:
     def __init__(self, img_input):
         if isinstance(img_input, str):
@@ -45,32 +120,7 @@ class Equirectangular:
         #
         # THETA is left/right angle, PHI is up/down angle, both in degree
         #
+        map1, map2 = remap_maps(FOV, THETA, PHI, height, width, self._img.shape[:2])
+        persp = cv2.remap(self._img, map1, map2, cv2.INTER_CUBIC, borderMode=cv2.BORDER_WRAP)
 
-        f = 0.5 * width * 1 / np.tan(0.5 * FOV / 180.0 * np.pi)
-        cx = (width - 1) / 2.0
-        cy = (height - 1) / 2.0
-        K = np.array([
-                [f, 0, cx],
-                [0, f, cy],
-                [0, 0,  1],
-            ], np.float32)
-        K_inv = np.linalg.inv(K)
-        
-        x = np.arange(width)
-        y = np.arange(height)
-        x, y = np.meshgrid(x, y)
-        z = np.ones_like(x)
-        xyz = np.concatenate([x[..., None], y[..., None], z[..., None]], axis=-1)
-        xyz = xyz @ K_inv.T
-
-        y_axis = np.array([0.0, 1.0, 0.0], np.float32)
-        x_axis = np.array([1.0, 0.0, 0.0], np.float32)
-        R1, _ = cv2.Rodrigues(y_axis * np.radians(THETA))
-        R2, _ = cv2.Rodrigues(np.dot(R1, x_axis) * np.radians(PHI))
-        R = R2 @ R1
-        xyz = xyz @ R.T
-        lonlat = xyz2lonlat(xyz) 
-        XY = lonlat2XY(lonlat, shape=self._img.shape).astype(np.float32)
-        persp = cv2.remap(self._img, XY[..., 0], XY[..., 1], cv2.INTER_CUBIC, borderMode=cv2.BORDER_WRAP)
-
-        return persp
\ No newline at end of file
+        return persp
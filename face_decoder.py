@@ -0,0 +1,84 @@
+from io import BytesIO
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from pillow_heif import register_heif_opener
+
+from config import APPLE_DECODE_WORKERS
+
+register_heif_opener()
+
+_pool = None
+
+
+def _decode_into(face_heic: bytes, size: Tuple[int, int], mode: str, shm_name: str):
+    """Worker side: decodes one HEIC face, resizes it to ``size`` and writes it into shared memory."""
+    # Spawned workers share the parent's resource tracker, so attaching doesn't take ownership
+    shm = SharedMemory(name=shm_name)
+    try:
+        image = Image.open(BytesIO(face_heic))
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+        out = np.ndarray((size[1], size[0], len(mode)), dtype=np.uint8, buffer=shm.buf)
+        out[:] = np.asarray(image.convert(mode))
+        del out
+    finally:
+        shm.close()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the bot process runs an event loop and worker threads
+        _pool = ProcessPoolExecutor(max_workers=APPLE_DECODE_WORKERS, mp_context=get_context("spawn"))
+    return _pool
+
+
+def decode_faces(faces_heic: List[bytes], sizes: List[Optional[Tuple[int, int]]] = None,
+                 mode: str = "RGBA") -> List[np.ndarray]:
+    """
+    Decodes and LANCZOS-resizes HEIC faces in parallel worker processes.
+
+    Each worker writes its face into a shared memory segment allocated here, so decoded pixels
+    never get pickled between processes. Blocks until every face is done; call through
+    ``asyncio.to_thread`` from the event loop.
+
+    :param faces_heic: The encoded faces.
+    :param sizes: The (width, height) to resize each face to; None keeps a face's own size.
+    :param mode: PIL mode of the output, "RGBA" or "RGB".
+    :return: The faces as uint8 arrays of shape (height, width, len(mode)), in input order.
+    """
+    if sizes is None:
+        sizes = [None] * len(faces_heic)
+    # Only the HEIC header is read for the native sizes
+    sizes = [size or Image.open(BytesIO(face_heic)).size for face_heic, size in zip(faces_heic, sizes)]
+    channels = len(mode)
+    segments = [SharedMemory(create=True, size=width * height * channels) for width, height in sizes]
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(_decode_into, face_heic, size, mode, shm.name)
+                   for face_heic, size, shm in zip(faces_heic, sizes, segments)]
+        for future in futures:
+            future.result()
+
+        faces = []
+        for (width, height), shm in zip(sizes, segments):
+            pixels = np.ndarray((height, width, channels), dtype=np.uint8, buffer=shm.buf)
+            faces.append(pixels.copy())
+            del pixels
+        return faces
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
@@ -1,9 +1,9 @@
 import os
-import aiohttp
 import logging
 import json
 from dotenv import load_dotenv
 from config import DEFAULT_MAP
+from network import borrow_session
 
 load_dotenv()
 NCFA = os.getenv("NCFA")
@@ -16,7 +16,8 @@ def load_json(filename):
 
 
 class GeoGuessr:
-    def __init__(self):
+    def __init__(self, session=None):
+        self.session = session
         self.headers = {
             "Content-Type": "application/json",
             "Cookie": f"_ncfa={NCFA}"
@@ -37,8 +38,8 @@ class GeoGuessr:
         else:
             self.map_id = map_id
 
-        async with aiohttp.ClientSession() as session:
-            game_response = await session.post(
+        async with borrow_session(self.session) as session:
+            async with session.post(
                 "https://www.geoguessr.com/api/v3/games",
                 headers=self.headers,
                 json={
@@ -49,12 +50,12 @@ class GeoGuessr:
                     "forbidZooming": True,
                     "forbidRotating": True
                 }
-            )
-            if game_response.status != 200:
-                logging.error(f"Error creating game: {game_response.status}")
-                self.game = None
+            ) as game_response:
+                if game_response.status != 200:
+                    logging.error(f"Error creating game: {game_response.status}")
+                    self.game = None
 
-            self.game = await game_response.json()
+                self.game = await game_response.json()
 
             return self.game
 
@@ -73,8 +74,8 @@ class GeoGuessr:
 
         game_id = self.game['token']
 
-        async with aiohttp.ClientSession() as session:
-            response = await session.post(
+        async with borrow_session(self.session) as session:
+            async with session.post(
                 f"https://www.geoguessr.com/api/v3/games/{game_id}",
                 headers=self.headers,
                 json={
@@ -84,23 +85,23 @@ class GeoGuessr:
                     "timedOut": False,
                     "stepsCount": 0
                 }
-            )
-            if response.status != 200:
-                logging.error(f"Error getting game data: {response.status}")
-                return None
+            ) as response:
+                if response.status != 200:
+                    logging.error(f"Error getting game data: {response.status}")
+                    return None
 
-            self.game = await response.json()
+                self.game = await response.json()
 
             # Advance to next round
-            self.game = await session.get(
+            async with session.get(
                 f"https://www.geoguessr.com/api/v3/games/{game_id}",
                 headers=self.headers
-            )
+            ) as response:
+                if response.status != 200:
+                    logging.error(f"Error advancing: {response.status}")
+                    return None
 
-            if response.status != 200:
-                logging.error(f"Error advancing: {response.status}")
-                return None
+                self.game = await response.json()
 
-            self.game = await self.game.json()
             logging.info(str(self.game['round']) + " - round begin")
             return self.game
@@ -0,0 +1,113 @@
+import time
+import random
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Collection, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config import TILE_MIRRORS, HOST_PROBE_INTERVAL, HOST_PROBE_TIMEOUT, HOST_EWMA_ALPHA, HOST_MAX_ERROR_RATE
+
+
+@dataclass
+class HostStats:
+    """Health of one mirror host."""
+    latency: Optional[float] = None
+    """EWMA of response latency in seconds, None until the first response."""
+    error_rate: float = 0.0
+    """EWMA of the share of failed requests (connection errors, timeouts and 5xx)."""
+
+
+class HostHealth:
+    """
+    Picks a healthy mirror for providers that serve their tiles from several hosts.
+
+    Every tile response and a periodic probe of each mirror feed an EWMA of latency and error
+    rate per host. ``pick`` spreads requests over the healthy mirrors, weighted towards the fast
+    ones; hosts whose error rate is above ``max_error_rate`` are skipped until a probe sees them
+    recover.
+    """
+
+    def __init__(self, mirrors: Dict[str, List[str]], alpha: float = HOST_EWMA_ALPHA,
+                 max_error_rate: float = HOST_MAX_ERROR_RATE):
+        self.mirrors = mirrors
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.stats = {urlsplit(base).netloc: HostStats() for bases in mirrors.values() for base in bases}
+        self._probe_task = None
+
+    def pick(self, provider: str, avoid: Collection[str] = ()) -> str:
+        """
+        Returns the base URL of a mirror of ``provider`` to send the next request to. Hosts in
+        ``avoid`` (e.g. the ones a tile just failed on) are only picked once every mirror is in it.
+        """
+        bases = [base for base in self.mirrors[provider] if urlsplit(base).netloc not in avoid] \
+            or self.mirrors[provider]
+        stats = [self.stats[urlsplit(base).netloc] for base in bases]
+        healthy = [(base, s) for base, s in zip(bases, stats) if s.error_rate <= self.max_error_rate]
+        if not healthy:
+            # Everything looks down; the least broken host is the best bet
+            return min(zip(bases, stats), key=lambda pair: pair[1].error_rate)[0]
+
+        known = [s.latency for _, s in healthy if s.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        weights = [(1 - s.error_rate) / max(s.latency if s.latency is not None else default_latency, 1e-3)
+                   for _, s in healthy]
+        return random.choices([base for base, _ in healthy], weights)[0]
+
+    def record(self, url: str, latency: Optional[float], ok: bool):
+        """Feeds one request outcome into the EWMAs of its host. Unknown hosts are ignored."""
+        stats = self.stats.get(urlsplit(url).netloc)
+        if stats is None:
+            return
+        stats.error_rate += self.alpha * ((0.0 if ok else 1.0) - stats.error_rate)
+        if ok and latency is not None:
+            stats.latency = latency if stats.latency is None else stats.latency + self.alpha * (latency - stats.latency)
+
+    async def probe(self, session: aiohttp.ClientSession):
+        """Sends one request to every mirror. Any response below 500 counts as the host being up."""
+
+        async def probe_one(base):
+            start = time.perf_counter()
+            try:
+                async with session.get(base, timeout=aiohttp.ClientTimeout(total=HOST_PROBE_TIMEOUT)) as response:
+                    ok = response.status < 500
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.debug(f"Probe of {base} failed: {e}")
+                ok = False
+            self.record(base, time.perf_counter() - start, ok)
+
+        await asyncio.gather(*[probe_one(base) for bases in self.mirrors.values() for base in bases])
+
+    def start(self, session: aiohttp.ClientSession, interval: float = HOST_PROBE_INTERVAL):
+        """Starts probing every ``interval`` seconds in the background."""
+
+        async def run():
+            while True:
+                try:
+                    await self.probe(session)
+                    logging.debug("Mirror health: " + ", ".join(
+                        f"{host} {s.latency * 1000 if s.latency is not None else float('nan'):.0f} ms "
+                        f"err {s.error_rate:.0%}" for host, s in self.stats.items()))
+                except Exception as e:
+                    logging.error(f"Mirror probe failed: {e}")
+                await asyncio.sleep(interval)
+
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(run())
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+
+host_health = HostHealth(TILE_MIRRORS)
@@ -0,0 +1,68 @@
+import threading
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class Metrics:
+    """
+    In-process counters and rolling latency windows for the image pipeline.
+
+    Counters only ever go up; gauges hold a current value such as a queue depth; latencies keep
+    the last ``window`` samples per name so percentiles follow the current behaviour of a
+    provider rather than its whole history.
+    """
+
+    def __init__(self, window: int = 512):
+        self.window = window
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def gauge(self, name: str, value: float):
+        """Sets the current value of ``name``."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Records one sample (usually seconds) for ``name``."""
+        with self._lock:
+            self._samples[name].append(value)
+
+    def count(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def samples(self, name: str) -> int:
+        samples = self._samples.get(name)
+        return len(samples) if samples else 0
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """The q-th percentile of the recent samples of ``name``, or None without samples."""
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        return float(np.percentile(samples, q)) if samples else None
+
+    def counters(self, prefix: str = "") -> Dict[str, int]:
+        with self._lock:
+            return {name: value for name, value in sorted(self._counters.items()) if name.startswith(prefix)}
+
+    def summary(self) -> List[str]:
+        """One line per counter and per latency window (p50/p95 in ms), for logs and !metrics."""
+        lines = [f"{name} = {value}" for name, value in self.counters().items()]
+        with self._lock:
+            lines += [f"{name} = {value}" for name, value in sorted(self._gauges.items())]
+            names = sorted(self._samples)
+        for name in names:
+            p50, p95 = self.percentile(name, 50), self.percentile(name, 95)
+            if p50 is not None:
+                lines.append(f"{name}: p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms (n={self.samples(name)})")
+        return lines
+
+
+metrics = Metrics()
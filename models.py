@@ -1,23 +1,27 @@
-import aiohttp
 import asyncio
 import certifi
-import io
 import os
 import json
 import logging
-import requests
 import math
+from functools import partial
 import sqlite3
 from math import radians, sin, cos, sqrt, atan2
 from typing import Self
 import numpy as np
 from PIL import Image, ImageFile
-from config import MAPS
+from config import MAPS, PANORAMA_BUFFER_POOL_BYTES, ROUND_PREVIEW_ZOOM_STEPS
 from coordTransform import bd09mc_to_wgs84
 from e2p import Equirectangular
-from py360convert import c2e
-from apple import get_apple_coverage_tile, get_apple_equ
+from cubemap import Cubemap, atlas_faces, atlas_shape, pad_atlas
+from viewport import TileGrid, visible_tiles, resolve_zoom
+from apple import get_apple_coverage_tile, get_apple_faces, render_perspective, visible_faces
 from auth import Authenticator
+from network import borrow_session, fetch_tile_bytes
+from hosts import host_health
+from tile_cache import tile_cache
+from tiles import stitch_as_completed, decode_tile_async, finish_in_thread
+from buffers import BufferPool
 from dotenv import load_dotenv
 # from pypinyin import lazy_pinyin
 
@@ -28,10 +32,8 @@ BIGDATACLOUD_API_KEY = os.getenv("BIGDATACLOUD_API_KEY")
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 auth = Authenticator()
+panorama_buffers = BufferPool(PANORAMA_BUFFER_POOL_BYTES)
 
-GSV_PANO_URL = "https://geo0.ggpht.com/cbk"
-BAIDU_PANO_URL = "https://mapsv0.bdimg.com/?qt=pdata"
-TENCENT_PANO_URL = "https://sv0.map.qq.com/tile"
 YANDEX_PANO_URL = "https://pano.maps.yandex.net"
 KAKAO_PANO_URL = "https://map0.daumcdn.net/map_roadview"
 BING_PREFIX = "BING:"
@@ -49,6 +51,16 @@ def strip_panoid(pano, prefix):
     return pano.replace(prefix, "")
 
 
+def get_provider(pano):
+    """Returns the street view provider of a pano id, e.g. 'baidu' for 'BAIDU:...'."""
+    pano = str(pano)
+    for prefix in (BING_PREFIX, APPLE_PREFIX, BAIDU_PREFIX, KAKAO_PREFIX, TENCENT_PREFIX, YANDEX_PREFIX,
+                   OPENMAP_PREFIX):
+        if pano.startswith(prefix):
+            return prefix[:-1].lower()
+    return "yandex" if pano == "yandex" else "google"
+
+
 def get_host_city(pano):
     if pano:
         parts = str(pano).split(':')
@@ -61,13 +73,19 @@ class Pano:
     A GSV panorama, with a unique ID and image file.
     """
 
-    def __init__(self, pano_id=None, lat=None, lng=None):
+    def __init__(self, pano_id=None, lat=None, lng=None, session=None):
+        self.session = session
         self.zoom = 4
         self.dimensions = None
         self.driving_direction = None
         self.origin_heading = None
         self.image_key = None
         self.apple_pano = None
+        self.apple_faces = {}
+        self.cube_atlas = None
+        self.yandex_zooms = []
+        self.yandex_base_zoom = None
+        self.preview = False
 
         if not pano_id:
             self.pano_id = None
@@ -82,13 +100,45 @@ class Pano:
             self.lng = None
 
         self.panorama = None
+        self._pooled_panorama = False
+        self.fetched_tiles = set()
         self.img = None
+        # Renders of one pano share its buffers, so they run one at a time
+        self._render_lock = asyncio.Lock()
+        self._release_pending = False
+
+    async def get_panorama(self, heading, pitch, FOV=125, full=False, zoom=None, preview=False):
+        """
+        Renders the perspective view for a heading and pitch.
+
+        Tiled providers only download the tiles the view actually samples, and Apple only the
+        faces it can see; later renders of other views (e.g. !antenna) fetch whatever is still
+        missing. Pass ``full=True`` to download the whole panorama. Apple and Bing views are
+        sampled straight from their faces rather than from an equirectangular panorama.
+
+        The tile zoom is the lowest level that resolves the requested FOV at the output size,
+        unless ``zoom`` asks for a specific level. A view that needs more detail than the
+        current panorama has rebuilds it at the higher level.
 
-    async def get_panorama(self, heading, pitch, FOV=125):
+        With ``preview`` the view is rendered from a level ROUND_PREVIEW_ZOOM_STEPS below that,
+        for a quick first image; ``self.preview`` tells whether the result is such a preview,
+        i.e. whether a plain call would render it in more detail.
+
+        Renders of the same pano wait for each other, and a ``release`` during a render takes
+        effect once it is done.
+        """
+        async with self._render_lock:
+            try:
+                return await self._render(heading, pitch, FOV, full, zoom, preview)
+            finally:
+                if self._release_pending:
+                    self._release_buffers()
+
+    async def _render(self, heading, pitch, FOV, full, zoom, preview):
         if self.pano_id is None:
             self.pano_id = await self.get_panoid()
 
-        if self.panorama is None:
+        if self.dimensions is None:
             if "BING:" == str(self.pano_id)[0:5]:
                 self.dimensions = [4096, 8192]
                 await self.get_pano_metadata_bing()
@@ -99,7 +149,7 @@ class Pano:
                 self.driving_direction = heading
                 self.dimensions = [2880, 5760]
             elif "BAIDU:" == str(self.pano_id)[0:6]:
-                # await self.get_pano_metadata_bd()
+                # Location metadata comes from get_pano_metadata_bd, fetched before the round renders
                 self.dimensions = [4096, 8192]
                 self.driving_direction = heading
             elif "TENCENT:" == str(self.pano_id)[0:8]:
@@ -114,28 +164,11 @@ class Pano:
             else:
                 await self.get_pano_metadata()
 
-            if "BING:" == str(self.pano_id)[0:5]:
-                self.panorama = await self.build_bing_streetside_panorama()
-            elif "APPLE:" == str(self.pano_id)[0:6]:
-                with requests.Session() as session:
-                    try:
-                        self.panorama = await asyncio.to_thread(
-                            get_apple_equ, self.apple_pano, 3, auth, session
-                        )
-                    except Exception as error:
-                        logging.error(f"Error getting apple equirectangular pano: {error}")
-                    finally:
-                        session.close()
-            else:
-                self.panorama = await self._fetch_and_build_panorama()
-
-        equ = Equirectangular(self.panorama)
-
         if "BING:" == str(self.pano_id)[0:5] or "TENCENT:" == str(self.pano_id)[0:8]:
             h = 0
         elif "YANDEX:" == str(self.pano_id)[0:7] or self.pano_id == 'yandex':
             h = 0
-            pitch = 5 if self.zoom == 1 else 0
+            pitch = 5 if self.yandex_base_zoom == 1 else 0
             FOV = 110
         elif "BAIDU:" == str(self.pano_id)[0:6]:
             h = 90
@@ -144,6 +177,59 @@ class Pano:
         else:
             h = heading - self.driving_direction
 
+        levels = self._zoom_levels()
+        preview_zoom = self._preview_zoom(levels, FOV) if preview else None
+        if preview_zoom is not None:
+            zoom = preview_zoom
+
+        if self.yandex_zooms:
+            wanted = zoom if zoom is not None and zoom < len(self.yandex_zooms) else self.yandex_base_zoom
+            if wanted != self.zoom:
+                self._release_buffers()
+                self._set_yandex_zoom(wanted)
+            self.preview = self.zoom != self.yandex_base_zoom
+        elif levels:
+            target_zoom = resolve_zoom(levels, FOV, 1920, zoom)
+            if (self.panorama is None and self.cube_atlas is None) or levels[target_zoom] > levels.get(self.zoom, 0):
+                self._release_buffers()
+                self.zoom = target_zoom
+            self.preview = levels[self.zoom] < levels[resolve_zoom(levels, FOV, 1920)]
+        else:
+            self.preview = False
+
+        provider = get_provider(self.pano_id)
+        if provider == "bing":
+            # Sampled straight from the cube faces, without an equirectangular panorama
+            if self.cube_atlas is None:
+                face_w = 256 * 2 ** self.zoom
+                self.cube_atlas = await asyncio.to_thread(panorama_buffers.acquire, atlas_shape(face_w))
+                await self.fetch_bing_streetside_tiles(strip_panoid(self.pano_id, BING_PREFIX), self.zoom,
+                                                       faces=atlas_faces(self.cube_atlas))
+                await finish_in_thread(pad_atlas, self.cube_atlas)
+            return await finish_in_thread(Cubemap(self.cube_atlas).GetPerspective, FOV, h, pitch, 1080, 1920)
+        elif provider == "apple":
+            # Rendered straight from the faces, without an equirectangular panorama
+            try:
+                faces = set(range(6)) if full else await asyncio.to_thread(
+                    visible_faces, self.apple_pano.camera_metadata, FOV, h, pitch, 1080, 1920)
+                missing = faces - set(self.apple_faces)
+                if missing:
+                    async with borrow_session(self.session) as session:
+                        fetched = await get_apple_faces(self.apple_pano, 3, auth, session, missing)
+                    self.apple_faces.update({i: face for i, face in enumerate(fetched) if face is not None})
+                face_images = [self.apple_faces.get(i) for i in range(6)]
+                return await asyncio.to_thread(render_perspective, face_images, self.apple_pano.camera_metadata,
+                                               FOV, h, pitch, 1080, 1920)
+            except Exception as error:
+                logging.error(f"Error rendering apple pano: {error}")
+                return None
+        else:
+            grid = self._tile_grid()
+            tiles = grid.all_tiles() if full else await asyncio.to_thread(
+                visible_tiles, grid, FOV, h, pitch, 1080, 1920)
+            await self._fetch_and_build_panorama(tiles)
+
+        equ = Equirectangular(self.panorama)
         result = equ.GetPerspective(FOV, h, pitch, 1080, 1920)
 
         return result
@@ -156,8 +242,7 @@ class Pano:
             async with session.get(tile_url) as response:
                 if response.status == 200:
                     image_data = await response.read()
-                    tile_img = Image.open(io.BytesIO(image_data))
-                    return tile_img
+                    return await decode_tile_async(image_data)
                 else:
                     print(f"Error: Failed to download tile {tile_url}")
                     return None
@@ -165,27 +250,9 @@ class Pano:
             print(f"Error: {e} while downloading tile {tile_url}")
             return None
 
-    def create_cubemap(self, tiles):
-        f, r, b, l, u, d = tiles
-
-        tile_width, tile_height = f.size
-
-        cubemap_width = 4 * tile_width
-        cubemap_height = 3 * tile_height
-        cubemap_img = Image.new('RGB', (cubemap_width, cubemap_height))
-
-        cubemap_img.paste(u, (tile_width, 0))  # 上面 (第一行，中央)
-        cubemap_img.paste(l, (0, tile_height))  # 左面 (第二行，左侧)
-        cubemap_img.paste(f, (tile_width, tile_height))  # 前面 (第二行，中央)
-        cubemap_img.paste(r, (2 * tile_width, tile_height))  # 右面 (第二行，右侧)
-        cubemap_img.paste(b, (3 * tile_width, tile_height))  # 背面 (第二行，最右)
-        cubemap_img.paste(d, (tile_width, 2 * tile_height))  # 下面 (第三行，中央)
-
-        return np.array(cubemap_img)
-
     async def fetch_cube_tiles(self, template):
         directions = ['f', 'r', 'b', 'l', 'u', 'd']
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             tasks = []
             for direction in directions:
                 task = self.fetch_cube_tile(session, template, direction)
@@ -195,24 +262,32 @@ class Pano:
             tiles = await asyncio.gather(*tasks)
             return tiles
 
-    async def fetch_single_tile(self, session, x, y, retries=3):
-        async def check_host_url(url):
-            try:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                    return response.status == 200
-            except Exception as e:
-                logging.error(f"Host check failed for {url}: {e}")
-                return False
+    def _tile_level(self):
+        """The provider-specific zoom level the tiles of this pano are requested at."""
+        provider = get_provider(self.pano_id)
+        if provider == "tencent":
+            return 2 if self.dimensions[1] == 7168 else 1
+        elif provider == "openmap":
+            return 0
+        return self.zoom
+
+    async def fetch_single_tile(self, session, x, y, retries=3, downloaded=None):
+        """
+        Returns the bytes of one tile, from the tile cache if it holds them. Downloaded tiles
+        are added to ``downloaded`` by (x, y) for the caller to cache, or cached right away.
+        """
+        provider = get_provider(self.pano_id)
+        level = self._tile_level()
+        data = await asyncio.to_thread(tile_cache.get, provider, self.pano_id, level, x, y)
+        if data is not None:
+            return data
 
         if "OPENMAP:" == str(self.pano_id)[0:8]:
-            host_1 = "https://storage.nambox.com/streetview-cdn/derivates/"
-            host_2 = "https://hn.storage.weodata.vn/streetview-cdn/derivates/"
             param_url = (
                 f"{strip_panoid(self.pano_id, OPENMAP_PREFIX)[0:2]}/{strip_panoid(self.pano_id, OPENMAP_PREFIX)[2:4]}/"
                 f"{strip_panoid(self.pano_id, OPENMAP_PREFIX)[4:6]}/{strip_panoid(self.pano_id, OPENMAP_PREFIX)[6:8]}/"
                 f"{strip_panoid(self.pano_id, OPENMAP_PREFIX)[9:]}/tiles/{x}_{y}.jpg")
-            TILE_URL = f"{host_1}{param_url}" if await check_host_url(
-                f"{host_1}{param_url}") else f"{host_2}{param_url}"
+            TILE_URL = lambda avoid: f"{host_health.pick('openmap', avoid)}{param_url}"
             params = None
         elif 'KAKAO:' == str(self.pano_id)[0:6]:
 
@@ -232,25 +307,25 @@ class Pano:
                 elif zoom == 2:
                     return f"{KAKAO_PANO_URL}{image_path}_HD1/{get_tile_image_name(image_path)}_HD1_{tile_index}.jpg"
 
-            TILE_URL = build_tile_url(self.image_key, 5, x, y)
+            TILE_URL = build_tile_url(self.image_key, level, x, y)
 
             params = None
 
         elif "BAIDU:" == str(self.pano_id)[0:6]:
-            TILE_URL = BAIDU_PANO_URL
+            TILE_URL = partial(host_health.pick, "baidu")
             params = {
                 "qt": "pdata",
                 "sid": strip_panoid(self.pano_id, BAIDU_PREFIX),
                 "pos": str(y) + '_' + str(x),
-                "z": 5
+                "z": level
             }
         elif "TENCENT:" == str(self.pano_id)[0:8]:
-            TILE_URL = TENCENT_PANO_URL
+            TILE_URL = partial(host_health.pick, "tencent")
             params = {
                 "svid": strip_panoid(self.pano_id, TENCENT_PREFIX),
                 "x": x,
                 "y": y,
-                "level": 2 if self.dimensions[1] == 7168 else 1,
+                "level": level,
                 "from": "web"
             }
         elif "YANDEX:" == str(self.pano_id)[0:7]:
@@ -258,7 +333,7 @@ class Pano:
             params = None
 
         else:
-            TILE_URL = GSV_PANO_URL
+            TILE_URL = partial(host_health.pick, "google")
             params = {
                 "cb_client": "apiv3",
                 "panoid": self.pano_id,
@@ -268,26 +343,61 @@ class Pano:
                 "y": y
             }
 
-        for attempt in range(retries):
-            try:
-                async with session.get(TILE_URL, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status != 200:
-                        logging.error(f"Error fetching tile {x},{y}: Status {response.status}")
-                        if attempt < retries - 1:
-                            await asyncio.sleep(1)
-                            continue
-                        return None
-                    data = await response.read()
-                    tile = Image.open(io.BytesIO(data))
-                    return tile
-            except Exception as e:
-                logging.error(f"Exception fetching tile {x},{y}: {e}")
-                if attempt < retries - 1:
-                    await asyncio.sleep(1)
-                    continue
-                return None
+        data = await fetch_tile_bytes(session, TILE_URL, params, provider, retries)
+        if data is not None:
+            if downloaded is not None:
+                downloaded[x, y] = data
+            else:
+                tile_cache.put_later([(provider, self.pano_id, level, x, y, data)])
+        return data
+
+    def _zoom_levels(self):
+        """
+        Zoom levels this pano can be fetched at, mapped to the width of the stitched image.
+        Empty for providers whose tiles only come at a single level.
+        """
+        provider = get_provider(self.pano_id)
+        width = self.dimensions[1]
+        if provider == "google" and width in (8192, 6656):  # dimensions are at zoom 4
+            return {zoom: width * 2 ** (zoom - 4) for zoom in range(2, 6)}
+        elif provider == "baidu":
+            return {zoom: width * 2 ** (zoom - 5) for zoom in range(3, 6)}
+        elif provider == "kakao":  # Google zoom 4 and 5 map to Kakao's 8- and 16-tile levels
+            return {4: width // 2, 5: width}
+        elif provider == "bing":  # four 256 * 2 ** zoom faces around the horizon
+            return {zoom: 4 * 256 * 2 ** zoom for zoom in range(1, 4)}
+        return {}
+
+    def _preview_zoom(self, levels, FOV):
+        """
+        The level ROUND_PREVIEW_ZOOM_STEPS below the one a full render of FOV uses, or None if
+        the provider has no cheaper level.
+        """
+        if self.yandex_zooms:
+            # Yandex lists its levels largest first, so the cheaper ones come after the base level
+            preview_zoom = min(self.yandex_base_zoom + ROUND_PREVIEW_ZOOM_STEPS, len(self.yandex_zooms) - 1)
+            return preview_zoom if preview_zoom != self.yandex_base_zoom else None
+        if not levels:
+            return None
+        by_width = sorted(levels, key=levels.get)
+        target = by_width.index(resolve_zoom(levels, FOV, 1920))
+        return by_width[max(target - ROUND_PREVIEW_ZOOM_STEPS, 0)] if target > 0 else None
+
+    def _set_yandex_zoom(self, zoom):
+        """Switches a Yandex pano to one of its listed levels."""
+        width, height = self.yandex_zooms[zoom]
+        if zoom != self.yandex_base_zoom:
+            # Like the base levels, the imagery is at most half as tall as it is wide
+            height = min(height, width // 2)
+        self.dimensions = [height, width]
+        self.zoom = zoom
+
+    def _tile_grid(self):
+        """Tile layout of this pano's equirectangular image at the current zoom."""
+        # 根据 dimensions 和 pano_id 设置 tile 尺寸
+        dimensions_map = {5760: (720, 720), 7168: (896, 896)}
+        tile_width, tile_height = dimensions_map.get(self.dimensions[1], (512, 512))
 
-    async def _fetch_and_build_panorama(self):
         if self.dimensions[1] == 8192:  # google Gen 4, qq, baidu, kakao
             max_x, max_y = 16, 8
         elif self.dimensions[1] == 6656:  # Gen 3
@@ -299,85 +409,91 @@ class Pano:
         else:  # Fallback
             max_x, max_y = 7, 4
 
-        if "YANDEX:" == str(self.pano_id)[0:7]:
-            max_x, max_y = math.ceil(self.dimensions[1] / 256), math.ceil(self.dimensions[0] / 256)
-            # if self.dimensions[0] == 2560:
-            #     max_x, max_y = 28, 10
-            # else:
-            #     max_x, max_y = 28, 14
-            # if self.dimensions[1] == 6912:
-            #     max_x, max_y = 27, 14
-
-        async with aiohttp.ClientSession() as session:
-            # Get tiles based on determined dimensions
-            raw_tiles = await asyncio.gather(
-                *[self.fetch_single_tile(session, x, y)
-                  for y in range(int(max_y) if max_y != 6.5 else 7)  # Handle Gen 3's 6.5
-                  for x in range(max_x)]
-            )
-
-            if max_y == 6.5:  # Handle Gen 3's half row
-                tiles = []
-                # First 6 rows
-                for y in range(6):
-                    for x in range(13):
-                        idx = y * max_x + x
-                        tiles.append(raw_tiles[idx])
-
-                # Half of 7th row
-                for x in range(13):
-                    idx = 6 * max_x + x
-                    tile = raw_tiles[idx]
-                    if tile is None:
-                        continue
-                    tile_array = np.array(tile)
-                    half_height = tile_array.shape[0] // 2
-                    half_tile = Image.fromarray(tile_array[:half_height])
-                    tiles.append(half_tile)
-
-                return self._stitch_panorama(tiles, max_x, max_y)
-            else:
-                return self._stitch_panorama(raw_tiles, max_x, max_y)
-
-    def _stitch_panorama(self, tiles, max_x, max_y):
-        # 根据 dimensions 和 pano_id 设置 tile 尺寸
-        dimensions_map = {5760: (720, 720), 7168: (896, 896)}
-        tile_width, tile_height = dimensions_map.get(self.dimensions[1], (512, 512))
-        if "YANDEX:" == str(self.pano_id)[0:7]:
-            tile_width, tile_height = 256, 256
-
-        # 检查是否是半高模式
-        is_half_height = max_y % 1 != 0
-        full_height = int(max_y)
-
-        # 计算总高度
-        last_row_height = tile_height // 2 if is_half_height else 0
-        total_height = (full_height * tile_height) + last_row_height
+        levels = self._zoom_levels()
+        if levels:
+            scale = levels[self.zoom] / self.dimensions[1]
+            max_x, max_y = max_x * scale, max_y * scale
 
         total_width = int(max_x * tile_width)
+        total_height = int(max_y * tile_height)
 
         if "YANDEX:" == str(self.pano_id)[0:7]:
-            if self.zoom == 1:
+            tile_width, tile_height = 256, 256
+            max_x, max_y = math.ceil(self.dimensions[1] / 256), math.ceil(self.dimensions[0] / 256)
+            total_width, total_height = max_x * tile_width, max_y * tile_height
+            if self.zoom == self.yandex_base_zoom == 1:  # base level of the 5+ level panos
                 total_height = 3584
             else:
                 total_height, total_width = self.dimensions[0], self.dimensions[1]
                 if self.dimensions[1] == 5632:
                     total_height = 2816
 
-        full_panorama = Image.new('RGB', (total_width, total_height))
+        return TileGrid(cols=math.ceil(max_x), rows=math.ceil(max_y), tile_width=tile_width, tile_height=tile_height,
+                        width=total_width, height=total_height)
 
-        # 拼接图像
-        for idx, img in enumerate(tiles):
-            x = (idx % int(max_x)) * tile_width
-            y = (idx // int(max_x)) * tile_height
+    async def _fetch_and_build_panorama(self, tiles=None):
+        """
+        Downloads the given (x, y) tiles, all of them by default, that are not stitched yet.
 
-            # 如果是半高模式，调整最后一行的位置
-            if is_half_height and y == full_height * tile_height:
-                y += last_row_height
+        Each tile is decoded into the panorama buffer as soon as it arrives. The buffer is
+        allocated (or taken from the buffer pool) on first use; tiles past the image edge, like
+        Gen 3's half row, are cropped.
+        """
+        grid = self._tile_grid()
+        if tiles is None:
+            tiles = grid.all_tiles()
+        missing = sorted(set(tiles) - self.fetched_tiles, key=lambda tile: (tile[1], tile[0]))
+        if not missing and self.panorama is not None:
+            return self.panorama
 
-            full_panorama.paste(img, (x, y))
+        if self.panorama is None:
+            self.panorama = await asyncio.to_thread(panorama_buffers.acquire, (grid.height, grid.width, 3))
+            self._pooled_panorama = True
+
+        # 边下载边拼接
+        downloaded = {}
+        async with borrow_session(self.session) as session:
+            stitched = await stitch_as_completed([
+                (self.panorama, x * grid.tile_width, y * grid.tile_height,
+                 self.fetch_single_tile(session, x, y, downloaded=downloaded))
+                for x, y in missing
+            ])
+        self.fetched_tiles.update(tile for tile, ok in zip(missing, stitched) if ok)
+
+        # Cached once stitched, off the critical path; tiles that failed to decode are not kept
+        provider, level = get_provider(self.pano_id), self._tile_level()
+        tile_cache.put_later((provider, self.pano_id, level, x, y, downloaded[x, y])
+                             for (x, y), ok in zip(missing, stitched) if ok and (x, y) in downloaded)
+
+        return self.panorama
 
-        return np.array(full_panorama)
+    @property
+    def held_bytes(self) -> int:
+        """Memory held by the stitched panorama or faces of this pano, not counting the rendered image."""
+        held = [self.panorama, self.cube_atlas, *self.apple_faces.values()]
+        return sum(array.nbytes for array in held if array is not None)
+
+    def release(self):
+        """
+        Drops the stitched panorama, handing its buffer back to the pool for the next round.
+        While a render is using it, that happens when the render finishes.
+        """
+        if self._render_lock.locked():
+            self._release_pending = True
+        else:
+            self._release_buffers()
+
+    def _release_buffers(self):
+        self._release_pending = False
+        if self.panorama is not None and self._pooled_panorama:
+            panorama_buffers.release(self.panorama)
+        self.panorama = None
+        self._pooled_panorama = False
+        if self.cube_atlas is not None:
+            panorama_buffers.release(self.cube_atlas)
+        self.cube_atlas = None
+        self.fetched_tiles = set()
+        self.apple_faces = {}
 
     async def get_panoid(self):
         url = "https://maps.googleapis.com/$rpc/google.internal.maps.mapsjs.v1.MapsJsInternalService/SingleImageSearch"
@@ -388,7 +504,7 @@ class Pano:
         radius = 50
         payload = f'[["apiv3"],[[null,null,{self.lat},{self.lng}],{radius}],[[null,null,null,null,null,null,null,null,null,null,[null,null]],null,null,null,null,null,null,null,[1],null,[[[2,true,2]]]],[[2,6]]]'
 
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             async with session.post(url, data=payload, headers=headers) as response:
                 try:
                     data = await response.json()
@@ -397,9 +513,11 @@ class Pano:
                     logging.error(f"Error getting panoid: {e}")
 
     async def get_pano_metadata_apple(self):
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             try:
-                apple_pano = await get_apple_coverage_tile(self.lat, self.lng, session)
+                pano_id = strip_panoid(self.pano_id, APPLE_PREFIX)
+                apple_pano = await get_apple_coverage_tile(self.lat, self.lng, session,
+                                                           int(pano_id) if pano_id.isdigit() else None)
                 if not apple_pano:
                     logging.error("Error getting apple metadata.")
                     return None
@@ -412,7 +530,7 @@ class Pano:
 
     async def get_pano_metadata_bing(self):
         url = f"https://t.ssl.ak.tiles.virtualearth.net/tiles/cmd/StreetSideBubbleMetaData?id={strip_panoid(self.pano_id, BING_PREFIX)}"
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             async with session.get(url) as resp:
                 try:
                     if resp.status == 200:
@@ -432,18 +550,15 @@ class Pano:
         YANDEX_SEARCH_URL = f"https://api-maps.yandex.com/services/panoramas/1.x/?l={endpoint}&lang=en_US&origin=userAction&provider=streetview"
         url = f"{YANDEX_SEARCH_URL}&ll={lng}%2C{lat}" if self.pano_id == 'yandex' else f"{YANDEX_SEARCH_URL}&oid={strip_panoid(self.pano_id, YANDEX_PREFIX)}"
 
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             async with session.get(url) as response:
                 try:
                     data = await response.json()
                     if data and 'data' in data and 'Data' in data['data'] and 'Images' in data['data']['Data']:
                         tiles_size = data['data']['Data']['Images']['Zooms']
-                        if len(tiles_size) > 4:
-                            self.dimensions = [tiles_size[1]['height'], tiles_size[1]['width']]
-                            self.zoom = 1
-                        else:
-                            self.dimensions = [tiles_size[0]['height'], tiles_size[0]['width']]
-                            self.zoom = 0
+                        self.yandex_zooms = [(level['width'], level['height']) for level in tiles_size]
+                        self.yandex_base_zoom = 1 if len(tiles_size) > 4 else 0
+                        self._set_yandex_zoom(self.yandex_base_zoom)
                         self.pano_id = f"YANDEX:{data['data']['Data']['panoramaId']}"
                         self.image_key = data['data']['Data']['Images']['imageId']
                         self.driving_direction = (data['data']['Data']['EquirectangularProjection']['Origin'][
@@ -463,7 +578,7 @@ class Pano:
         KAKAO_SEARCH_URL = "https://rv.map.kakao.com/roadview-search/v2/nodes?TYPE=w&SERVICE=glpano"
 
         url = f"{KAKAO_METADATA_URL}/{strip_panoid(self.pano_id, KAKAO_PREFIX)}?SERVICE=glpano"
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             async with session.get(url) as response:
                 try:
                     data = await response.json()
@@ -499,7 +614,7 @@ class Pano:
             [[1, 2, 3, 4, 8, 6]]
         ]
 
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             async with session.post(url, json=request_data, headers=headers) as response:
                 try:
                     data = await response.json()
@@ -523,8 +638,12 @@ class Pano:
                     return None
 
     async def get_pano_metadata_bd(self):
+        """
+        Fetches only the location (converted from BD-09 Mercator to WGS-84) and the capture
+        direction of a Baidu pano, without touching its imagery.
+        """
         url = f'https://mapsv0.bdimg.com/?qt=sdata&sid={strip_panoid(self.pano_id, BAIDU_PREFIX)}'
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             try:
                 async with session.get(url) as response:
                     if response.status == 200:
@@ -534,8 +653,8 @@ class Pano:
                             if metadata:
                                 wgs84 = bd09mc_to_wgs84(metadata['X'] / 100, metadata['Y'] / 100)
                                 self.lat, self.lng = wgs84[1], wgs84[0]
-                                self.dimensions = [4096, 8192]
-                                self.driving_direction = metadata['MoveDir']
+                                # Rendering keeps using the round heading (see get_panorama)
+                                self.origin_heading = metadata['MoveDir']
                     return None
             except Exception as error:
                 logging.error(f"Error getting metadata: {error}")
@@ -543,7 +662,7 @@ class Pano:
 
     async def get_pano_metadata_qq(self):
         url = f'https://sv.map.qq.com/sv?svid={strip_panoid(self.pano_id, TENCENT_PREFIX)}&output=jsonp'
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             try:
                 async with session.get(url) as response:
                     if response.status != 200:
@@ -648,68 +767,46 @@ class Pano:
                 y += delta
         return int(x), int(y)
 
-    async def fetch_bing_streetside_tiles(self, pano_id, ZOOM=3):
+    async def fetch_bing_streetside_tiles(self, pano_id, ZOOM=3, tile_size=256, faces=None):
+        """
+        下载6个面的全部tile，边下载边拼接，返回6个面的RGB uint8数组
+        Pass ``faces`` (e.g. the views from ``cubemap.atlas_faces``) to stitch into existing arrays.
+        """
         id4 = self.to_base4(int(pano_id)).rjust(16, "0")
         WIDTH = 2 ** ZOOM  # 8
-        tiles = [[None for _ in range(WIDTH * WIDTH)] for _ in range(6)]  # 6 faces
+        if faces is None:
+            faces = [np.zeros((WIDTH * tile_size, WIDTH * tile_size, 3), dtype=np.uint8) for _ in range(6)]  # 6 faces
 
         semaphore = asyncio.Semaphore(128)
 
         async def fetch_tile(session, face, position):
+            cached = await asyncio.to_thread(tile_cache.get, "bing", pano_id, ZOOM, face, position)
+            if cached is not None:
+                return cached
+
             face4 = self.to_base4(face + 1).rjust(2, "0")
             position4 = self.to_base4(position).rjust(ZOOM, "0")
             url = f"https://t.ssl.ak.tiles.virtualearth.net/tiles/hs{id4}{face4}{position4}.jpg?g=13716"
 
-            try:
-                async with semaphore:
-                    async with session.get(url) as resp:
-                        if resp.status == 200:
-                            img_data = await resp.read()
-                            img = Image.open(io.BytesIO(img_data)).convert("RGB")
-                            return face, position, img
-                        else:
-                            return face, position, None
-            except Exception as e:
-                logging.error(f"Error downloading {url}: {e}")
-                return face, position, None
-
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                fetch_tile(session, face, position)
-                for face in range(6)
-                for position in range(WIDTH * WIDTH)
-            ]
-            results = await asyncio.gather(*tasks)
+            async with semaphore:
+                img_data = await fetch_tile_bytes(session, url, provider="bing")
+            if img_data is not None:
+                downloaded[face, position] = img_data
+            return img_data
 
-        for face, position, img in results:
-            tiles[face][position] = img
+        downloaded = {}
+        tiles = [(face, position) for face in range(6) for position in range(WIDTH * WIDTH)]
+        placements = []
+        async with borrow_session(self.session) as session:
+            for face, position in tiles:
+                x, y = self.quadtree_position_to_xy(self.to_base4(position).zfill(ZOOM), WIDTH)
+                placements.append((faces[face], x * tile_size, y * tile_size, fetch_tile(session, face, position)))
+            stitched = await stitch_as_completed(placements)
 
-        return tiles
+        tile_cache.put_later(("bing", pano_id, ZOOM, face, position, downloaded[face, position])
+                             for (face, position), ok in zip(tiles, stitched) if ok and (face, position) in downloaded)
 
-    @staticmethod
-    def stitch_bing_streetside_face(tiles: list, width: int = 8, tile_size: int = 256) -> Image.Image:
-        """
-        拼接单个面的64张tile为一张大图，tiles为长度64的PIL.Image列表
-        """
-        face_img = Image.new("RGB", (width * tile_size, width * tile_size))
-        for idx, tile in enumerate(tiles):
-            if tile is None:
-                continue
-            pos_str = Pano.to_base4(idx).zfill(3)
-            x, y = Pano.quadtree_position_to_xy(pos_str, width)
-            face_img.paste(tile, (x * tile_size, y * tile_size))
-        return face_img
-
-    async def build_bing_streetside_panorama(self):
-        """
-        下载并拼接 Bing Streetside 全景图，返回equirectangular numpy数组
-        """
-        tiles = await self.fetch_bing_streetside_tiles(strip_panoid(self.pano_id, BING_PREFIX))
-        faces = [self.stitch_bing_streetside_face(face_tiles) for face_tiles in tiles]
-        cubemap_img = self.create_cubemap(faces)
-        # 转为equirectangular
-        equirectangular_array = c2e(np.array(cubemap_img), 2048, 4096)
-        return equirectangular_array
+        return faces
 
     def to_dict(self):
         """Return a JSON-serializable representation of the Pano"""
@@ -736,10 +833,11 @@ class Round:
         locality (str): Locality name
     """
 
-    def __init__(self, round_data):
+    def __init__(self, round_data, session=None):
 
-        self.pano = Pano(pano_id=round_data['panoId'], lat=round_data['lat'], lng=round_data['lng']) if round_data[
-            'panoId'] else Pano(lat=round_data['lat'], lng=round_data['lng'])
+        self.session = session
+        self.pano = Pano(pano_id=round_data['panoId'] or None, lat=round_data['lat'], lng=round_data['lng'],
+                         session=session)
         self.heading = round_data['heading']
         self.pitch = round_data['pitch']
         self.zoom = round_data['zoom']
@@ -775,7 +873,7 @@ class Round:
             "key": BIGDATACLOUD_API_KEY
         }
 
-        async with aiohttp.ClientSession() as session:
+        async with borrow_session(self.session) as session:
             async with session.get(url, params=params) as response:
                 logging.debug(f"Reverse geocoding status: {response.status}")
                 if response.status == 403:
@@ -854,7 +952,7 @@ class Round:
         return self.subdivision, self.adm_2, self.locality
 
     @staticmethod
-    async def reconstruct_round(round_data: dict, pano_processor) -> Self:
+    async def reconstruct_round(round_data: dict, pano_processor, session=None) -> Self:
         """Helper to reconstruct a Round object from saved data"""
         pano_data = round_data['pano']
         round_obj = Round({
@@ -864,7 +962,7 @@ class Round:
             'zoom': round_data['zoom'],
             'lat': round_data['lat'],
             'lng': round_data['lng']
-        })
+        }, session)
         round_obj.subdivision = round_data['subdivision']
         round_obj.adm_2 = round_data['adm_2'] if 'adm_2' in round_data else None
         round_obj.locality = round_data['locality'] if 'locality' in round_data else None
@@ -937,7 +1035,7 @@ class GameManager:
         db_path (str): Path to the SQLite database file
         subdivisions (list): List of subdivisions to use for location info
         rounds (dict): Current round data for each channel
-        next_rounds (dict): Next round data for each channel
+        next_rounds (dict): Queue (deque) of prefetched upcoming rounds for each channel
         waiting_for_guess (dict): Whether a channel is waiting for a guess
         streak (dict): Current streak count for each channel
         five_k_attempts (dict): 5k attempts for each user in each channel
@@ -1187,7 +1285,8 @@ class GameManager:
     def save_state(self, channel_id: int, game_data: dict):
         with sqlite3.connect(self.db_path) as conn:
             current_round = json.dumps(self.rounds[channel_id].to_dict()) if channel_id in self.rounds else None
-            next_round = json.dumps(self.next_rounds[channel_id].to_dict()) if channel_id in self.next_rounds else None
+            upcoming = self.next_rounds.get(channel_id)
+            next_round = json.dumps([round_obj.to_dict() for round_obj in upcoming]) if upcoming else None
 
             conn.execute("""
                 INSERT OR REPLACE INTO game_state 
@@ -1223,9 +1322,20 @@ class GameManager:
                 'streak': row[0],
                 'game_data': json.loads(row[1]) if row[1] else None,
                 'current_round': json.loads(row[2]) if row[2] else None,
-                'next_round': json.loads(row[3]) if row[3] else None
+                'next_rounds': self.saved_rounds(row[3])
             }
 
+    @staticmethod
+    def saved_rounds(next_round: str) -> list:
+        """
+        The prefetched rounds stored in a saved ``next_round`` column, in order. Older states
+        hold a single round rather than a list.
+        """
+        if not next_round:
+            return []
+        saved = json.loads(next_round)
+        return saved if isinstance(saved, list) else [saved]
+
     def end_streak(self, channel_id: int):
         """Force-end the current streak for a channel"""
         with sqlite3.connect(self.db_path) as conn:
@@ -1363,6 +1473,13 @@ class GameManager:
 
         return (True, distance)
 
+    def set_round(self, channel_id, round_obj):
+        """Make round_obj the current round of a channel, recycling the previous round's panorama"""
+        previous = self.rounds.get(channel_id)
+        self.rounds[channel_id] = round_obj
+        if previous is not None and previous is not round_obj:
+            previous.pano.release()
+
     def reset_5k_attempts(self, channel_id):
         """Reset 5k attempts for a channel"""
         self.five_k_attempts[channel_id] = {}
@@ -0,0 +1,197 @@
+import ssl
+import time
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable, Collection, Dict, Optional, Union
+from urllib.parse import urlsplit
+
+import aiohttp
+import certifi
+
+from config import (
+    HTTP_CONNECTION_LIMIT,
+    HTTP_CONNECTION_LIMIT_PER_HOST,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_DNS_CACHE_TTL,
+    TILE_REQUEST_TIMEOUT,
+    TILE_RETRIES,
+    TILE_BACKOFF_BASE,
+    TILE_BACKOFF_MAX,
+    TILE_HEDGE_PERCENTILE,
+    TILE_HEDGE_MIN_SAMPLES,
+    TILE_HEDGE_MIN_DELAY,
+)
+from metrics import metrics
+from hosts import host_health
+
+
+class HttpPool:
+    """
+    A single long-lived aiohttp session shared by every pano, metadata and game request.
+
+    Connections are kept alive between rounds and DNS lookups are cached, so a warm round
+    reuses existing TCP+TLS connections. The per-host limit keeps one busy tile provider
+    from starving the others (or GeoGuessr itself) of sockets.
+    """
+
+    def __init__(self, limit: int = HTTP_CONNECTION_LIMIT, limit_per_host: int = HTTP_CONNECTION_LIMIT_PER_HOST,
+                 keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT, dns_cache_ttl: int = HTTP_DNS_CACHE_TTL):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> aiohttp.ClientSession:
+        """Create the shared session. Must be called from within the running event loop."""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                ssl=ssl.create_default_context(cafile=certifi.where())
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+            logging.info(f"HTTP pool started (limit={self.limit}, per host={self.limit_per_host})")
+        return self.session
+
+    async def close(self):
+        """Close the shared session and every pooled connection."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logging.info("HTTP pool closed")
+        self.session = None
+
+
+@asynccontextmanager
+async def borrow_session(session: Optional[aiohttp.ClientSession] = None):
+    """
+    Yields the shared session when one is available, otherwise a throwaway session
+    that is closed on exit (for scripts and callers that run without the bot).
+    """
+    if session is not None and not session.closed:
+        yield session
+    else:
+        async with aiohttp.ClientSession() as temp_session:
+            yield temp_session
+
+
+def backoff_delay(attempt: int, base: float = TILE_BACKOFF_BASE, cap: float = TILE_BACKOFF_MAX) -> float:
+    """Exponential backoff with full jitter: a random delay up to base * 2^attempt, capped."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def hedge_delay(provider: str) -> Optional[float]:
+    """
+    How long to wait on a tile request before sending a duplicate: the provider's recent
+    TILE_HEDGE_PERCENTILE latency, or None until enough responses have been timed.
+    """
+    if metrics.samples(f"tile_latency.{provider}") < TILE_HEDGE_MIN_SAMPLES:
+        return None
+    return max(TILE_HEDGE_MIN_DELAY, metrics.percentile(f"tile_latency.{provider}", TILE_HEDGE_PERCENTILE))
+
+
+async def _get_bytes(session: aiohttp.ClientSession, url: str, params, provider: str,
+                     failed: Dict[str, Optional[int]], timed: bool = True) -> Optional[bytes]:
+    """
+    One request. A failure is noted in ``failed``: the host, with the status or None if no
+    response came. With ``timed`` the latency feeds the provider's hedge threshold.
+    """
+    start = time.perf_counter()
+    host = urlsplit(url).netloc
+    try:
+        async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=TILE_REQUEST_TIMEOUT)) as response:
+            if response.status != 200:
+                logging.error(f"Error fetching tile {url}: Status {response.status}")
+                host_health.record(url, None, response.status < 500)
+                failed[host] = response.status
+                return None
+            data = await response.read()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"Exception fetching tile {url}: {e}")
+        host_health.record(url, None, False)
+        failed[host] = None
+        return None
+    latency = time.perf_counter() - start
+    if timed:
+        metrics.observe(f"tile_latency.{provider}", latency)
+    host_health.record(url, latency, True)
+    return data
+
+
+async def _hedged_get(session: aiohttp.ClientSession, url: Callable[[Collection[str]], str], params,
+                      provider: str, failed: Dict[str, Optional[int]]) -> Optional[bytes]:
+    """
+    One attempt, duplicated once if the first request outlives the provider's hedge delay.
+    Both requests avoid the hosts in ``failed``, and the duplicate also the first one's host.
+
+    Only first requests are timed for the hedge threshold, including the ones a duplicate beat:
+    timing duplicates from when they were sent, and dropping the slow requests they replace,
+    would hide the slow tail and pull the threshold down until ever more requests are hedged.
+    """
+    start = time.perf_counter()
+    first_url = url(failed.keys())
+    tasks = [asyncio.create_task(_get_bytes(session, first_url, params, provider, failed))]
+    try:
+        delay = hedge_delay(provider)
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                metrics.incr(f"tile_hedges.{provider}")
+                hedge_url = url(failed.keys() | {urlsplit(first_url).netloc})
+                tasks.append(asyncio.create_task(_get_bytes(session, hedge_url, params, provider, failed,
+                                                            timed=False)))
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                data = task.result()
+                if data is not None:
+                    if task is not tasks[0]:
+                        metrics.incr(f"tile_hedge_wins.{provider}")
+                    return data
+        return None
+    finally:
+        if len(tasks) > 1 and not tasks[0].done():
+            # Still waiting when the duplicate won: it took at least this long
+            metrics.observe(f"tile_latency.{provider}", time.perf_counter() - start)
+        # The first response wins; the other request is dropped and its connection freed
+        for task in tasks:
+            task.cancel()
+
+
+async def fetch_tile_bytes(session: aiohttp.ClientSession, url: Union[str, Callable[[Collection[str]], str]],
+                           params=None, provider: str = "google", retries: int = TILE_RETRIES) -> Optional[bytes]:
+    """
+    Downloads one tile, hedging slow requests and retrying failures with jittered backoff.
+
+    ``url`` may be a function returning the URL to use, called again for every request with the
+    hosts the tile already failed on, so retries and hedges of a mirrored provider go to another
+    host (see ``HostHealth.pick``). Mirrors don't all hold the same tiles, so a 4xx from one moves
+    on to an untried mirror straight away, without backoff or using up a retry. Latency, hedges
+    and failures are recorded per provider in ``metrics``.
+    """
+    if isinstance(url, str):
+        url = (lambda fixed: lambda avoid: fixed)(url)
+    metrics.incr(f"tile_requests.{provider}")
+    failed = {}
+    attempt = 0
+    while attempt < retries:
+        data = await _hedged_get(session, url, params, provider, failed)
+        if data is not None:
+            return data
+        missing = any(status is not None and 400 <= status < 500 for status in failed.values())
+        if missing and urlsplit(url(failed.keys())).netloc not in failed:
+            continue
+        attempt += 1
+        if attempt < retries:
+            await asyncio.sleep(backoff_delay(attempt - 1))
+    metrics.incr(f"tile_failures.{provider}")
+    return None
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+
+from config import ROUND_PREFETCH_DEPTH, ROUND_PREFETCH_MAX_BYTES
+from metrics import metrics
+from models import Round
+
+# (game data, round index) of a round GeoGuessr has revealed
+RevealedRound = Tuple[dict, int]
+
+
+class RoundPrefetcher:
+    """
+    Keeps up to ``depth`` upcoming rounds of a channel processed ahead of time.
+
+    GeoGuessr only reveals a round once the game has advanced to it, so each refill step
+    advances the game by one round and processes the revealed round. Refilling happens one
+    round at a time in a background task, started whenever a round is taken from the queue.
+
+    The panoramas held by queued rounds are kept under ``max_bytes``; rounds past the budget
+    release theirs and keep only their rendered image, which is all a round needs to be shown.
+    """
+
+    def __init__(self, channel_id: int, rounds: Deque[Round],
+                 advance: Callable[[], Awaitable[Optional[RevealedRound]]],
+                 process: Callable[[dict, int], Awaitable[Optional[Round]]],
+                 depth: int = ROUND_PREFETCH_DEPTH, max_bytes: int = ROUND_PREFETCH_MAX_BYTES):
+        """
+        :param channel_id: Channel the rounds are for; names the metrics.
+        :param rounds: The queue to fill, i.e. the channel's ``GameManager.next_rounds``.
+        :param advance: Advances the game and returns the newly revealed round, or None.
+        :param process: Builds the Round (metadata, image, location) of a revealed round.
+        """
+        self.channel_id = channel_id
+        self.rounds = rounds
+        self.advance = advance
+        self.process = process
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self._revealed: List[RevealedRound] = []
+        self._refill_task = None
+        self._cancelled = False
+        self._changed = asyncio.Event()
+
+    def refill(self, revealed: RevealedRound = None):
+        """
+        Starts topping the queue up in the background, if it isn't already. ``revealed`` is a
+        round the game has already revealed, processed before the game is advanced any further.
+        """
+        if revealed is not None:
+            self._revealed.append(revealed)
+        if not self._cancelled and self._refilled():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        try:
+            while len(self.rounds) < self.depth:
+                revealed = self._revealed.pop(0) if self._revealed else await self.advance()
+                if revealed is None:
+                    break
+                round_obj = await self.process(*revealed)
+                if round_obj is None:
+                    # Leave the queue short rather than burn through the game; the next pop retries
+                    logging.error(f"{self.channel_id}: Prefetching round {revealed[1]} failed")
+                    break
+                self.rounds.append(round_obj)
+                self._bound_memory()
+                self._report()
+                self._changed.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"{self.channel_id}: Prefetching rounds failed: {e}")
+        finally:
+            self._changed.set()
+
+    def _bound_memory(self):
+        """Releases the panoramas of the rounds furthest ahead once the queue holds more than max_bytes."""
+        held = 0
+        for round_obj in self.rounds:
+            held += round_obj.pano.held_bytes
+            if held > self.max_bytes:
+                held -= round_obj.pano.held_bytes
+                round_obj.pano.release()
+                metrics.incr("prefetch_released")
+
+    def _refilled(self) -> bool:
+        """Whether no refill is running, counting one cleared or cancelled by stop()."""
+        return self._refill_task is None or self._refill_task.done()
+
+    def _report(self):
+        metrics.gauge(f"prefetch_depth.{self.channel_id}", len(self.rounds))
+
+    async def pop(self) -> Optional[Round]:
+        """
+        Takes the next round, waiting for the refill if the queue ran dry (a prefetch miss).
+        Returns None if no round could be prefetched, or the prefetcher was cancelled meanwhile.
+        """
+        if self.rounds:
+            metrics.incr("prefetch_hits")
+        else:
+            metrics.incr("prefetch_misses")
+            self.refill()
+            while not self.rounds and not self._refilled():
+                self._changed.clear()
+                await self._changed.wait()
+            if not self.rounds:
+                return None
+
+        round_obj = self.rounds.popleft()
+        self._report()
+        self.refill()
+        return round_obj
+
+    def stop(self):
+        """Stops refilling for good but keeps the queued rounds, e.g. to save them on shutdown."""
+        self._cancelled = True
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        self._revealed.clear()
+        self._changed.set()
+
+    def cancel(self):
+        """Stops refilling and drops every queued round, e.g. when the channel switches maps."""
+        self.stop()
+        for round_obj in self.rounds:
+            round_obj.pano.release()
+        self.rounds.clear()
+        self._report()
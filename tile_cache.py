@@ -0,0 +1,178 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config import TILE_CACHE_DIR, TILE_CACHE_MAX_BYTES, TILE_CACHE_TOUCH_BATCH
+
+
+class TileCache:
+    """
+    A persistent on-disk cache for compressed panorama tiles.
+
+    Tiles are stored under the SHA-256 of (provider, pano id, zoom, x, y) and tracked in a
+    small SQLite index, so the LRU order and the total size survive restarts. Once the cache
+    grows past ``max_bytes`` the least recently used tiles are evicted.
+
+    Nothing touches the disk until the cache is first used. ``get`` and ``put`` block on disk
+    I/O; call them through ``asyncio.to_thread`` from the event loop. ``put_later`` hands the
+    writes to a background thread and returns at once. Hits only note their access time, which
+    is written in batches of ``touch_batch``.
+    """
+
+    def __init__(self, path: str = TILE_CACHE_DIR, max_bytes: int = TILE_CACHE_MAX_BYTES,
+                 touch_batch: int = TILE_CACHE_TOUCH_BATCH):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tile-cache")
+
+    def _open(self) -> sqlite3.Connection:
+        """Opens the index on first use. Caller holds the lock."""
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.path, "index.db"), check_same_thread=False)
+            # Commits only wait for the log, not for every write to reach the disk
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS tiles (
+                        key TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL,
+                        last_access REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access)")
+            self.total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(provider: str, pano_id: str, zoom, x, y) -> str:
+        return hashlib.sha256(f"{provider}|{pano_id}|{zoom}|{x}|{y}".encode()).hexdigest()
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, provider: str, pano_id: str, zoom, x, y) -> Optional[bytes]:
+        """Returns the cached tile bytes, or None on a miss."""
+        key = self.make_key(provider, pano_id, zoom, x, y)
+        try:
+            with open(self._file_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            self._touched[key] = time.time()
+            flush = len(self._touched) >= self.touch_batch
+        if flush:
+            self._writer.submit(self._write_touched)
+        return data
+
+    def put(self, provider: str, pano_id: str, zoom, x, y, data: bytes):
+        """Stores tile bytes and evicts old tiles if the byte budget is exceeded."""
+        self._put_many([(provider, pano_id, zoom, x, y, data)])
+
+    def put_later(self, tiles: Iterable[Tuple[str, str, Any, Any, Any, bytes]]):
+        """Stores (provider, pano id, zoom, x, y, data) tiles in the background."""
+        tiles = list(tiles)
+        if tiles:
+            self._writer.submit(self._put_in_background, tiles)
+
+    def _put_in_background(self, tiles):
+        try:
+            self._put_many(tiles)
+        except Exception as e:
+            logging.error(f"Caching {len(tiles)} tiles failed: {e}")
+
+    def _put_many(self, tiles):
+        """Writes the tile files, then indexes them all in one transaction."""
+        rows = []
+        for provider, pano_id, zoom, x, y, data in tiles:
+            if not data or len(data) > self.max_bytes:
+                continue
+            key = self.make_key(provider, pano_id, zoom, x, y)
+            file_path = self._file_path(key)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+            rows.append((key, len(data)))
+        if not rows:
+            return
+
+        with self._lock:
+            conn = self._open()
+            now = time.time()
+            with conn:
+                for key, size in rows:
+                    row = conn.execute("SELECT size FROM tiles WHERE key = ?", (key,)).fetchone()
+                    conn.execute("""
+                        INSERT OR REPLACE INTO tiles (key, size, last_access)
+                        VALUES (?, ?, ?)
+                    """, (key, size, now))
+                    self.total_bytes += size - (row[0] if row else 0)
+            if self.total_bytes > self.max_bytes:
+                self._flush_touched()
+                self._evict()
+
+    def _write_touched(self):
+        with self._lock:
+            self._open()
+            self._flush_touched()
+
+    def _flush_touched(self):
+        """Writes the access times of recent hits. Caller holds the lock and has opened the index."""
+        if not self._touched:
+            return
+        with self._conn:
+            self._conn.executemany("UPDATE tiles SET last_access = ? WHERE key = ?",
+                                   [(last_access, key) for key, last_access in self._touched.items()])
+        self._touched.clear()
+
+    def _evict(self):
+        """Removes least recently used tiles until the cache fits its budget. Caller holds the lock."""
+        evicted = 0
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM tiles ORDER BY last_access LIMIT 256").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            removed = []
+            for key, size in rows:
+                try:
+                    os.remove(self._file_path(key))
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= size
+                removed.append((key,))
+                if self.total_bytes <= self.max_bytes:
+                    break
+            with self._conn:
+                self._conn.executemany("DELETE FROM tiles WHERE key = ?", removed)
+            evicted += len(removed)
+
+        logging.debug(f"Tile cache evicted {evicted} tiles ({self.total_bytes} bytes in use)")
+
+    def close(self):
+        """Finishes the pending writes and closes the index."""
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            if self._conn is not None:
+                self._flush_touched()
+                self._conn.close()
+                self._conn = None
+
+
+tile_cache = TileCache()
@@ -0,0 +1,114 @@
+import io
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from config import TILE_DECODE_WORKERS
+
+# OpenCV releases the GIL while decoding, so a thread pool decodes tiles in parallel without
+# pickling tile data between processes. The pool size also bounds how many decodes run at once.
+decode_executor = ThreadPoolExecutor(max_workers=TILE_DECODE_WORKERS, thread_name_prefix="tile-decode")
+
+
+def _decode_bgr(data: bytes) -> Optional[np.ndarray]:
+    tile = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if tile is not None:
+        return tile
+    # OpenCV gives up on some damaged tiles that PIL (with LOAD_TRUNCATED_IMAGES) still reads
+    try:
+        return cv2.cvtColor(np.asarray(Image.open(io.BytesIO(data)).convert("RGB")), cv2.COLOR_RGB2BGR)
+    except Exception:
+        return None
+
+
+def decode_tile(data: bytes) -> Optional[np.ndarray]:
+    """Decodes a compressed tile to an RGB uint8 array, or None if it can't be read."""
+    tile = _decode_bgr(data)
+    return None if tile is None else cv2.cvtColor(tile, cv2.COLOR_BGR2RGB)
+
+
+def stitch_tile(canvas: np.ndarray, data: bytes, left: int, top: int) -> bool:
+    """
+    Decodes a compressed tile straight into ``canvas[top:, left:]``.
+
+    The tile is cropped where it runs past the canvas edge (e.g. Gen 3's half row). Returns
+    False if the tile couldn't be decoded or lies entirely outside the canvas.
+    """
+    tile = _decode_bgr(data)
+    if tile is None:
+        return False
+
+    height = min(tile.shape[0], canvas.shape[0] - top)
+    width = min(tile.shape[1], canvas.shape[1] - left)
+    if height <= 0 or width <= 0:
+        return False
+
+    cv2.cvtColor(tile[:height, :width], cv2.COLOR_BGR2RGB, dst=canvas[top:top + height, left:left + width])
+    return True
+
+
+async def decode_tile_async(data: bytes) -> Optional[np.ndarray]:
+    """Like ``decode_tile``, but runs on the decode pool instead of the event loop."""
+    if data is None:
+        return None
+    return await asyncio.get_running_loop().run_in_executor(decode_executor, decode_tile, data)
+
+
+async def stitch_as_completed(placements: List[Tuple[np.ndarray, int, int, Awaitable[Optional[bytes]]]]) -> List[bool]:
+    """
+    Streams downloads into their canvases as they finish.
+
+    Each placement is ``(canvas, left, top, download)``. Whenever a download completes its bytes
+    are handed to the decode pool right away, so decoding overlaps the downloads still in flight
+    and compressed tiles don't pile up waiting for the slowest one. Returns, per placement,
+    whether the tile was stitched.
+    """
+    async def download(index, awaitable):
+        return index, await awaitable
+
+    downloads = [asyncio.ensure_future(download(i, p[3])) for i, p in enumerate(placements)]
+    decodes = {}
+    stitched = None
+    try:
+        for next_tile in asyncio.as_completed(downloads):
+            index, data = await next_tile
+            if data is not None:
+                canvas, left, top, _ = placements[index]
+                decodes[index] = decode_executor.submit(stitch_tile, canvas, data, left, top)
+
+        stitched = dict(zip(decodes, await asyncio.gather(*map(asyncio.wrap_future, decodes.values()))))
+    finally:
+        # Downloads still in flight after a cancellation or error would only hold connections
+        for task in downloads:
+            task.cancel()
+        if stitched is None:
+            await _settle(decodes.values())
+    return [stitched.get(i, False) for i in range(len(placements))]
+
+
+async def _settle(decodes: Iterable[Future]):
+    """
+    After the caller failed or was cancelled: drops the decodes that haven't started and waits
+    for the running ones. A running decode can't be stopped and would keep writing into a canvas the
+    caller is about to give back to the buffer pool.
+    """
+    running = [asyncio.wrap_future(decode) for decode in decodes if not decode.cancel() and not decode.done()]
+    if running:
+        await asyncio.wait(running)
+
+
+async def finish_in_thread(func, *args):
+    """
+    Like ``asyncio.to_thread``, but if the caller is cancelled the call still runs to the end
+    before the cancellation is passed on, so the buffers it reads or writes stay in use until then.
+    """
+    call = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(call)
+    except asyncio.CancelledError:
+        await asyncio.wait([call])
+        raise
@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from e2p import perspective_map
+
+
+@dataclass
+class TileGrid:
+    """Layout of the tiles that make up an equirectangular panorama."""
+    cols: int
+    """Number of tile columns."""
+    rows: int
+    """Number of tile rows (a partial last row counts as a row)."""
+    tile_width: int  #:
+    tile_height: int  #:
+    width: int
+    """Width of the stitched panorama; tiles past it are cropped."""
+    height: int
+    """Height of the stitched panorama; tiles past it are cropped."""
+
+    def all_tiles(self) -> Set[Tuple[int, int]]:
+        return {(x, y) for y in range(self.rows) for x in range(self.cols)}
+
+
+def visible_tiles(grid: TileGrid, FOV, THETA, PHI, height, width) -> Set[Tuple[int, int]]:
+    """
+    Returns the (x, y) tiles that a perspective view samples from.
+
+    Uses the same source map as ``Equirectangular.GetPerspective`` and includes the full 4x4
+    neighbourhood read by bicubic interpolation, wrapped like ``cv2.BORDER_WRAP``. Tiles outside
+    the returned set can be left blank without changing the rendered view.
+    """
+    X, Y = perspective_map(FOV, THETA, PHI, height, width, (grid.height, grid.width))
+    x0 = np.floor(X).astype(np.int32)
+    y0 = np.floor(Y).astype(np.int32)
+
+    needed = np.zeros((grid.rows, grid.cols), dtype=bool)
+    for dy in (-1, 2):
+        tile_y = np.minimum(((y0 + dy) % grid.height) // grid.tile_height, grid.rows - 1)
+        for dx in (-1, 2):
+            tile_x = np.minimum(((x0 + dx) % grid.width) // grid.tile_width, grid.cols - 1)
+            needed[tile_y, tile_x] = True
+
+    tile_ys, tile_xs = np.nonzero(needed)
+    return {(int(x), int(y)) for x, y in zip(tile_xs, tile_ys)}
+
+
+def required_width(FOV, width) -> float:
+    """Equirectangular width whose pixel density matches the centre of a perspective view."""
+    focal_length = 0.5 * width / np.tan(0.5 * np.radians(FOV))
+    return 2 * np.pi * focal_length
+
+
+def resolve_zoom(levels: Dict[int, int], FOV, width, override: Optional[int] = None) -> int:
+    """
+    Picks the lowest zoom level that still resolves a perspective view at full detail.
+
+    :param levels: Available zoom levels mapped to the equirectangular width they produce.
+    :param FOV: Horizontal field of view of the output, in degree.
+    :param width: Output width in pixels.
+    :param override: A zoom level to use instead, if the provider has it.
+    :return: The chosen zoom level; the highest one if none is detailed enough.
+    """
+    if override is not None and override in levels:
+        return override
+
+    needed = required_width(FOV, width)
+    by_width = sorted(levels, key=levels.get)
+    return next((zoom for zoom in by_width if levels[zoom] >= needed), by_width[-1])